@@ -8,6 +8,8 @@ FastAPI server for:
 
 Endpoints:
     POST /analyze - Analyze floor plan
+    POST /analyze/url - Analyze floor plan, annotated image served by URL
+    GET /image/{digest} - Annotated floor plan image
     POST /analyze-furniture - Identify furniture in room images
     POST /search-products - Find where to buy similar furniture
     POST /analyze-and-shop - Combined: identify + search
@@ -15,13 +17,24 @@ Endpoints:
 """
 
 import os
-import base64
+import re
+import time
+import uuid
+import hashlib
+import tempfile
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from pathlib import Path
 from typing import Optional, List
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+import httpx
+import msgspec
+import orjson
+from fastapi import Depends, FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse, Response
-from pydantic import BaseModel
 from dotenv import load_dotenv
 
 from .floor_plan_analyzer import FloorPlanAnalyzer
@@ -30,17 +43,34 @@ from .product_search import ProductSearchAgent, VisualSearchAgent
 
 load_dotenv()
 
+
+class ORJSONResponse(JSONResponse):
+    """JSON response serialized with orjson, straight to bytes."""
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own the pooled HTTP client used for RasterScan and product search calls."""
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+    yield
+    await app.state.http_client.aclose()
+
+
 app = FastAPI(
     title="Floor Plan & Furniture Analyzer API",
     description="Analyze floor plans, identify furniture, and find products online",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# Initialize analyzers
-furniture_analyzer = FurnitureAnalyzer()
-product_search_agent = ProductSearchAgent()
-visual_search_agent = VisualSearchAgent()
-
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -49,30 +79,178 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-analyzer = FloorPlanAnalyzer()
+# Low compression level: the PNG inside the base64 barely compresses, but
+# gzip still recovers most of the base64 expansion cheaply. Raw PNG
+# responses are already compressed, so they are sent as-is.
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=8192,
+    compresslevel=4,
+    exclude_content_types=("text/event-stream", "image/png")
+)
+
+
+# Analyzers are created on first use so endpoints that are never called
+# don't pay for building their API clients.
+def get_floor_plan_analyzer(request: Request) -> FloorPlanAnalyzer:
+    return _floor_plan_analyzer(request.app.state.http_client)
+
+
+@lru_cache(maxsize=None)
+def _floor_plan_analyzer(http_client: httpx.AsyncClient) -> FloorPlanAnalyzer:
+    return FloorPlanAnalyzer(http_client=http_client)
+
+
+@lru_cache(maxsize=None)
+def get_furniture_analyzer() -> FurnitureAnalyzer:
+    return FurnitureAnalyzer()
+
+
+@lru_cache(maxsize=None)
+def get_product_search_agent() -> ProductSearchAgent:
+    return ProductSearchAgent()
+
+
+def get_visual_search_agent(request: Request) -> VisualSearchAgent:
+    return _visual_search_agent(request.app.state.http_client)
+
+
+@lru_cache(maxsize=None)
+def _visual_search_agent(http_client: httpx.AsyncClient) -> VisualSearchAgent:
+    return VisualSearchAgent(client=http_client)
 
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+PRICE_PATTERN = re.compile(r'\$?([\d,]+\.?\d*)')
+
+# Leading bytes of each accepted image format
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpeg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
+
+# Precomputed so validation does no per-request string building
+_SIGNATURE_PREFIXES = tuple(IMAGE_SIGNATURES)
+_ALLOWED_TYPES = ", ".join(t.upper() for t in dict.fromkeys([*IMAGE_SIGNATURES.values(), "webp"]))
+_INVALID_TYPE_MESSAGE = f"Invalid file type. Allowed: {_ALLOWED_TYPES}"
+_TOO_LARGE_MESSAGE = f"File too large. Max: {MAX_FILE_SIZE // (1024*1024)}MB"
+
+# Annotated PNGs served by /image/{digest}, stored as <sha256>.png. They
+# live on disk rather than in process memory so that any worker can serve
+# an image another worker produced.
+ANNOTATED_IMAGE_DIR = Path(
+    os.getenv("ANNOTATED_IMAGE_DIR", os.path.join(tempfile.gettempdir(), "floor_plan_images"))
+)
+ANNOTATED_IMAGE_TTL = 24 * 3600
+_DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
 
 
-def validate_image(filename: str, content: bytes) -> tuple[bool, str]:
-    """Validate uploaded image file."""
-    if not filename:
-        return False, "No filename provided"
+def save_annotated_image(image_bytes: bytes) -> str:
+    """
+    Store an annotated PNG for /image/{digest}, dropping expired ones.
+    
+    Args:
+        image_bytes: PNG bytes
     
-    ext = os.path.splitext(filename)[1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        return False, f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+    Returns:
+        SHA-256 hex digest the image is served under
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    ANNOTATED_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    path = ANNOTATED_IMAGE_DIR / f"{digest}.png"
     
-    if len(content) > MAX_FILE_SIZE:
-        return False, f"File too large. Max: {MAX_FILE_SIZE // (1024*1024)}MB"
+    if path.exists():
+        # Same image again; restart its expiry
+        os.utime(path)
+    else:
+        # Write then rename, so no worker ever serves a partial file
+        temp_path = ANNOTATED_IMAGE_DIR / f"{digest}.{uuid.uuid4().hex}.tmp"
+        temp_path.write_bytes(image_bytes)
+        os.replace(temp_path, path)
     
-    if len(content) == 0:
+    cutoff = time.time() - ANNOTATED_IMAGE_TTL
+    for entry in os.scandir(ANNOTATED_IMAGE_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass  # Removed by another worker
+    
+    return digest
+
+
+def load_annotated_image(digest: str) -> Optional[bytes]:
+    """Read a stored annotated PNG, or None if unknown or expired."""
+    # Only plain digests, so the path can't escape the directory
+    if not _DIGEST_PATTERN.fullmatch(digest):
+        return None
+    
+    path = ANNOTATED_IMAGE_DIR / f"{digest}.png"
+    try:
+        if path.stat().st_mtime < time.time() - ANNOTATED_IMAGE_TTL:
+            return None
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def validate_image(header: bytes, size: int) -> tuple[bool, str]:
+    """Validate uploaded image file from its leading bytes and size."""
+    if size == 0:
         return False, "Empty file"
     
+    # WEBP is RIFF with the format tag at offset 8, so it can't be a prefix
+    is_webp = header[:4] == b"RIFF" and header[8:12] == b"WEBP"
+    if not (header.startswith(_SIGNATURE_PREFIXES) or is_webp):
+        return False, _INVALID_TYPE_MESSAGE
+    
     return True, "OK"
 
 
+async def read_image(image: UploadFile) -> bytearray:
+    """
+    Read and validate an uploaded image.
+    
+    Oversized uploads are rejected with 413 from the declared size, or as
+    soon as the running size passes the limit. The file type is checked
+    from the first 16 bytes before the rest is read. When the size is
+    known the upload is read into a single preallocated buffer.
+    """
+    if image.size is not None and image.size > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail=_TOO_LARGE_MESSAGE)
+    
+    header = await image.read(16)
+    valid, message = validate_image(header, len(header))
+    if not valid:
+        raise HTTPException(status_code=400, detail=message)
+    
+    if image.size is None:
+        content = bytearray(header)
+        while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+            content += chunk
+            if len(content) > MAX_FILE_SIZE:
+                raise HTTPException(status_code=413, detail=_TOO_LARGE_MESSAGE)
+        return content
+    
+    content = bytearray(image.size)
+    offset = len(header)
+    content[:offset] = header
+    with memoryview(content) as view:
+        while offset < len(content):
+            read = await run_in_threadpool(image.file.readinto, view[offset:])
+            if not read:
+                break
+            offset += read
+    
+    # Guard against a short read leaving zeroed bytes at the end
+    if offset < len(content):
+        content = content[:offset]
+    return content
+
+
 @app.get("/health")
 async def health_check():
     """Check if service is running."""
@@ -82,7 +260,8 @@ async def health_check():
 @app.post("/analyze")
 async def analyze_floor_plan(
     image: UploadFile = File(...),
-    context: Optional[str] = Form(None)
+    context: Optional[str] = Form(None),
+    analyzer: FloorPlanAnalyzer = Depends(get_floor_plan_analyzer)
 ):
     """
     Analyze a floor plan image.
@@ -100,11 +279,7 @@ async def analyze_floor_plan(
             - room_count: Number of rooms
     """
     try:
-        content = await image.read()
-
-        valid, message = validate_image(image.filename, content)
-        if not valid:
-            raise HTTPException(status_code=400, detail=message)
+        content = await read_image(image)
 
         file_size_mb = len(content) / (1024 * 1024)
         print(f"[api] POST /analyze received: filename={image.filename}, size={file_size_mb:.2f}MB, context={context or 'none'}")
@@ -115,7 +290,7 @@ async def analyze_floor_plan(
         total_area = result.get('total_area_sqft', 0)
         print(f"[api] POST /analyze complete: {room_count} rooms, {total_area} sqft")
 
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
 
     except HTTPException:
         raise
@@ -127,7 +302,8 @@ async def analyze_floor_plan(
 @app.post("/analyze/image")
 async def analyze_get_image(
     image: UploadFile = File(...),
-    context: Optional[str] = Form(None)
+    context: Optional[str] = Form(None),
+    analyzer: FloorPlanAnalyzer = Depends(get_floor_plan_analyzer)
 ):
     """
     Analyze floor plan and return annotated image directly.
@@ -135,19 +311,14 @@ async def analyze_get_image(
     Returns PNG image with room overlays.
     """
     try:
-        content = await image.read()
+        content = await read_image(image)
         
-        valid, message = validate_image(image.filename, content)
-        if not valid:
-            raise HTTPException(status_code=400, detail=message)
+        result = await analyzer.analyze(content, context, return_image="bytes")
         
-        result = await analyzer.analyze(content, context)
-        
-        annotated_b64 = result.get("annotated_image_base64")
-        if not annotated_b64:
+        image_bytes = result.get("annotated_image_bytes")
+        if not image_bytes:
             raise HTTPException(status_code=500, detail="Failed to generate image")
         
-        image_bytes = base64.b64decode(annotated_b64)
         return Response(content=image_bytes, media_type="image/png")
         
     except HTTPException:
@@ -156,9 +327,62 @@ async def analyze_get_image(
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
+@app.post("/analyze/url")
+async def analyze_with_image_url(
+    image: UploadFile = File(...),
+    context: Optional[str] = Form(None),
+    analyzer: FloorPlanAnalyzer = Depends(get_floor_plan_analyzer)
+):
+    """
+    Analyze a floor plan, returning the annotated image by URL.
+    
+    Same as /analyze, but instead of embedding the PNG as base64 the
+    response carries annotated_image_url, which serves the raw PNG from
+    GET /image/{digest}.
+    """
+    try:
+        content = await read_image(image)
+        
+        result = await analyzer.analyze(content, context, return_image="bytes")
+        
+        response = {
+            key: value for key, value in result.items()
+            if key not in ("annotated_image_base64", "annotated_image_bytes")
+        }
+        image_bytes = result.get("annotated_image_bytes")
+        if image_bytes:
+            digest = await run_in_threadpool(save_annotated_image, image_bytes)
+            response["annotated_image_url"] = f"/image/{digest}"
+        else:
+            response["annotated_image_url"] = None
+        
+        return ORJSONResponse(content=response)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+
+@app.get("/image/{digest}")
+async def get_annotated_image(digest: str):
+    """Serve an annotated floor plan PNG produced by /analyze/url."""
+    image_bytes = await run_in_threadpool(load_annotated_image, digest)
+    if image_bytes is None:
+        raise HTTPException(status_code=404, detail="Image not found or expired")
+    
+    # Content-addressed, so the bytes behind a digest never change
+    return Response(
+        content=image_bytes,
+        media_type="image/png",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
 @app.post("/analyze-furniture")
 async def analyze_furniture_endpoint(
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    furniture_analyzer: FurnitureAnalyzer = Depends(get_furniture_analyzer)
 ):
     """
     Analyze a room design image to identify furniture.
@@ -174,14 +398,10 @@ async def analyze_furniture_endpoint(
             - color_palette: Dominant colors
     """
     try:
-        content = await image.read()
+        content = await read_image(image)
         
-        valid, message = validate_image(image.filename, content)
-        if not valid:
-            raise HTTPException(status_code=400, detail=message)
-        
-        result = furniture_analyzer.analyze(content)
-        return JSONResponse(content=result)
+        result = await run_in_threadpool(furniture_analyzer.analyze, content)
+        return ORJSONResponse(content=result)
         
     except HTTPException:
         raise
@@ -189,7 +409,7 @@ async def analyze_furniture_endpoint(
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
-class FurnitureObject(BaseModel):
+class FurnitureObject(msgspec.Struct):
     name: str
     category: str
     primary_color: str = ""
@@ -199,15 +419,20 @@ class FurnitureObject(BaseModel):
     description: str = ""
 
 
+_furniture_decoder = msgspec.json.Decoder(FurnitureObject)
+
+
 @app.post("/search-products")
 async def search_products_endpoint(
-    furniture: FurnitureObject
+    request: Request,
+    product_search_agent: ProductSearchAgent = Depends(get_product_search_agent)
 ):
     """
     Search for similar products online based on furniture details.
     
     Args:
-        furniture: Furniture object details (name, category, colors, style)
+        request: JSON body with furniture object details (name, category,
+            colors, style), decoded as a FurnitureObject
     
     Returns:
         JSON with:
@@ -217,8 +442,13 @@ async def search_products_endpoint(
             - recommendations: List of product recommendations
     """
     try:
-        result = product_search_agent.search(furniture.model_dump())
-        return JSONResponse(content=result)
+        furniture = _furniture_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    try:
+        result = await product_search_agent.search_async(msgspec.structs.asdict(furniture))
+        return ORJSONResponse(content=result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -226,7 +456,9 @@ async def search_products_endpoint(
 
 @app.post("/analyze-and-shop")
 async def analyze_and_shop_endpoint(
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    furniture_analyzer: FurnitureAnalyzer = Depends(get_furniture_analyzer),
+    visual_search_agent: VisualSearchAgent = Depends(get_visual_search_agent)
 ):
     """
     Combined: Analyze furniture in image AND search for similar products.
@@ -242,61 +474,49 @@ async def analyze_and_shop_endpoint(
             - color_palette: Dominant colors
     """
     try:
-        content = await image.read()
-        
-        valid, message = validate_image(image.filename, content)
-        if not valid:
-            raise HTTPException(status_code=400, detail=message)
+        content = await read_image(image)
         
         # Step 1: Analyze furniture
-        analysis = furniture_analyzer.analyze(content)
+        analysis = await run_in_threadpool(furniture_analyzer.analyze, content)
         
         if analysis.get("status") != "success":
-            return JSONResponse(content=analysis)
+            return ORJSONResponse(content=analysis)
         
         # Step 2: Search for real products for each object using ThorData
-        objects_with_shopping = []
-        for obj in analysis.get("objects", []):
+        objects = analysis.get("objects", [])
+        search_queries = []
+        for obj in objects:
             # Build search query from object details
-            name = obj.get("name", "")
             category = obj.get("category", "")
             style = obj.get("style_tags", [""])[0] if obj.get("style_tags") else ""
             
-            search_query = f"{style} {category}" if style else category
-            
-            # Use ThorData visual search for real product link
-            search_result = visual_search_agent.search_products(search_query)
-            
-            obj_with_shopping = {
-                **obj,
-                "product": search_result.get("product")
-            }
-            objects_with_shopping.append(obj_with_shopping)
+            search_queries.append(f"{style} {category}" if style else category)
         
-        # Extract object names list
-        object_names = [obj.get("name") for obj in objects_with_shopping]
+        search_results = await visual_search_agent.search_products_batch(search_queries)
         
-        # Calculate total price
+        # Merge products onto objects, collecting names and prices in one pass
+        objects_with_shopping = []
+        object_names = []
         total_price = 0.0
         price_count = 0
-        for obj in objects_with_shopping:
-            product = obj.get("product")
+        for obj, search_result in zip(objects, search_results):
+            product = search_result.get("product")
+            objects_with_shopping.append({**obj, "product": product})
+            object_names.append(obj.get("name"))
+            
             if product and product.get("price"):
-                price_str = product.get("price", "")
                 # Extract first numeric price from string (e.g., "$1,250.00" or "$90.00$99")
-                import re
-                price_match = re.search(r'\$?([\d,]+\.?\d*)', price_str)
+                price_match = PRICE_PATTERN.search(str(product["price"]))
                 if price_match:
                     try:
-                        price_value = float(price_match.group(1).replace(',', ''))
-                        total_price += price_value
+                        total_price += float(price_match.group(1).replace(',', ''))
                         price_count += 1
                     except ValueError:
                         pass
         
         total_price_str = f"${total_price:,.2f}" if price_count > 0 else "N/A"
         
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "success",
             "object_names": object_names,
             "total_price": total_price_str,
@@ -313,7 +533,8 @@ async def analyze_and_shop_endpoint(
 
 @app.post("/visual-search")
 async def visual_search_endpoint(
-    query: str = Form(...)
+    query: str = Form(...),
+    visual_search_agent: VisualSearchAgent = Depends(get_visual_search_agent)
 ):
     """
     Search for products by description using ThorData Google Search.
@@ -324,8 +545,8 @@ async def visual_search_endpoint(
     Returns single best matching product with real purchase link.
     """
     try:
-        result = visual_search_agent.search_products(query)
-        return JSONResponse(content=result)
+        result = await visual_search_agent.search_products_async(query)
+        return ORJSONResponse(content=result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -340,6 +561,8 @@ async def root():
         "endpoints": {
             "POST /analyze": "Analyze floor plan, returns JSON with rooms and base64 image",
             "POST /analyze/image": "Analyze floor plan, returns PNG image directly",
+            "POST /analyze/url": "Analyze floor plan, returns JSON with rooms and an image URL",
+            "GET /image/{digest}": "Annotated floor plan PNG from /analyze/url",
             "POST /analyze-furniture": "Identify furniture in room images",
             "POST /search-products": "Find where to buy similar furniture",
             "POST /analyze-and-shop": "Combined: identify furniture + search products",
@@ -349,10 +572,26 @@ async def root():
     }
 
 
-def run_server(host: str = "0.0.0.0", port: int = 8000):
-    """Run the API server."""
+def run_server(host: str = "0.0.0.0", port: int = 8000, workers: Optional[int] = None):
+    """
+    Run the API server.
+    
+    Uses one worker per CPU unless WEB_CONCURRENCY or `workers` says
+    otherwise. uvloop and httptools are picked up automatically when
+    installed (uvicorn[standard]).
+    """
     import uvicorn
-    uvicorn.run(app, host=host, port=port)
+    if workers is None:
+        workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    uvicorn.run(
+        "src.api:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        backlog=2048
+    )
 
 
 if __name__ == "__main__":
@@ -7,14 +7,76 @@ for accurate button placement on the frontend.
 """
 
 import os
-import json
 import re
-from typing import List, Dict, Optional
-from anthropic import Anthropic
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
+import orjson
 from dotenv import load_dotenv
+from .claude_client import get_claude_client
 
 load_dotenv()
 
+# Label keywords mapped to room types, in match priority order
+_TYPE_KEYWORDS = {
+    'LIVING': 'living_room',
+    'BEDROOM': 'bedroom',
+    'MASTER': 'bedroom',
+    'KITCHEN': 'kitchen',
+    'DINING': 'dining_room',
+    'BATH': 'bathroom',
+    'CLOSET': 'closet',
+    'OFFICE': 'office',
+    'GARAGE': 'garage',
+    'HALLWAY': 'hallway',
+    'ENTRANCE': 'entrance'
+}
+
+# Finds every keyword in a label with one scan
+_TYPE_KEYWORD_PATTERN = re.compile("|".join(_TYPE_KEYWORDS))
+
+
+@lru_cache(maxsize=512)
+def _keyword_room_types(name_upper: str) -> Tuple[str, ...]:
+    """Room types implied by keywords in a label, in match priority order."""
+    found = set(_TYPE_KEYWORD_PATTERN.findall(name_upper))
+    return tuple(dict.fromkeys(
+        room_type for keyword, room_type in _TYPE_KEYWORDS.items() if keyword in found
+    ))
+
+
+@lru_cache(maxsize=256)
+def _button_prompt(width: int, height: int, room_list: str) -> str:
+    """Button position prompt; repeat plans reuse the built string."""
+    prompt = f"""Analyze this annotated floor plan image ({width}x{height} pixels).
+
+The image shows colored room overlays with room names/labels written on them.
+
+Expected room names: {room_list}
+
+IMPORTANT: Look for ALL room labels including small text labels. Some rooms like bathrooms may have smaller or less prominent labels - make sure to include them.
+
+For EACH visible room label/name text in the image, identify:
+1. room_name: The exact text of the room label as it appears (e.g., "LIVING ROOM", "BEDROOM", "KITCHEN", "BATHROOM")
+2. x: Center X coordinate of where the label text is positioned (0 to {width} pixels)
+3. y: Center Y coordinate of where the label text is positioned (0 to {height} pixels)
+
+The coordinates should point to the CENTER of each room's label text.
+
+Return ONLY valid JSON (no markdown, no explanation):
+
+{{
+  "buttons": [
+    {{"room_name": "LIVING ROOM", "x": 350, "y": 400}},
+    {{"room_name": "BEDROOM", "x": 800, "y": 250}},
+    {{"room_name": "KITCHEN", "x": 150, "y": 150}},
+    {{"room_name": "BATHROOM", "x": 600, "y": 200}}
+  ]
+}}
+
+Include ALL room labels you can see in the image, even if the text is small or faint. Match the names exactly as they appear.
+Do NOT skip rooms - if you see a colored room area, look carefully for its label."""
+    return prompt
+
 
 class ButtonPositionAnalyzer:
     """
@@ -31,9 +93,19 @@ class ButtonPositionAnalyzer:
         # - room_data: Full room JSON object
     """
     
+    # Rooms smaller than this only get a button if they are an important type
+    MIN_AREA_SQFT = 30
+    EXCLUDED_TYPES = frozenset({'closet', 'storage'})
+    IMPORTANT_TYPES = frozenset({'bathroom', 'kitchen', 'bedroom', 'living_room', 'dining_room'})
+    
+    # Approximate button footprint, in percent of the image, for overlap fixing
+    BUTTON_WIDTH = 15.0
+    BUTTON_HEIGHT = 8.0
+    MIN_SPACING = 2.0    # Minimum spacing between buttons
+    
     def __init__(self):
         self.api_key = os.getenv("ANTHROPIC_API_KEY")
-        self.client = Anthropic(api_key=self.api_key) if self.api_key else None
+        self.client = get_claude_client(self.api_key) if self.api_key else None
         self.model = "claude-sonnet-4-20250514"
     
     def analyze(
@@ -62,126 +134,23 @@ class ButtonPositionAnalyzer:
             print("Warning: ANTHROPIC_API_KEY not configured for button positioning")
             return self._fallback_positions(rooms_data, width, height)
         
-        # Filter out small rooms (closets, small storage)
-        MIN_AREA_SQFT = 30  # Only include rooms >= 30 sq ft
-        EXCLUDED_TYPES = ['closet', 'storage']  # Exclude these room types
-        IMPORTANT_TYPES = ['bathroom', 'kitchen', 'bedroom', 'living_room', 'dining_room']  # Always include these
-        
-        filtered_rooms = [
-            r for r in rooms_data 
-            if (r.get('area_sqft', 0) >= MIN_AREA_SQFT or r.get('type', '') in IMPORTANT_TYPES)
-            and r.get('type', '') not in EXCLUDED_TYPES
-        ]
+        filtered_rooms = self.filter_rooms(rooms_data)
         
         if not filtered_rooms:
             print("No rooms meet minimum area requirement")
             return []
         
         try:
-            # Build room names list for the prompt
-            room_names = [r.get('name', '') for r in filtered_rooms]
-            room_list = ", ".join(f'"{name}"' for name in room_names if name)
-            
-            prompt = f"""Analyze this annotated floor plan image ({width}x{height} pixels).
-
-The image shows colored room overlays with room names/labels written on them.
-
-Expected room names: {room_list}
-
-IMPORTANT: Look for ALL room labels including small text labels. Some rooms like bathrooms may have smaller or less prominent labels - make sure to include them.
-
-For EACH visible room label/name text in the image, identify:
-1. room_name: The exact text of the room label as it appears (e.g., "LIVING ROOM", "BEDROOM", "KITCHEN", "BATHROOM")
-2. x: Center X coordinate of where the label text is positioned (0 to {width} pixels)
-3. y: Center Y coordinate of where the label text is positioned (0 to {height} pixels)
-
-The coordinates should point to the CENTER of each room's label text.
-
-Return ONLY valid JSON (no markdown, no explanation):
-
-{{
-  "buttons": [
-    {{"room_name": "LIVING ROOM", "x": 350, "y": 400}},
-    {{"room_name": "BEDROOM", "x": 800, "y": 250}},
-    {{"room_name": "KITCHEN", "x": 150, "y": 150}},
-    {{"room_name": "BATHROOM", "x": 600, "y": 200}}
-  ]
-}}
-
-Include ALL room labels you can see in the image, even if the text is small or faint. Match the names exactly as they appear.
-Do NOT skip rooms - if you see a colored room area, look carefully for its label."""
-
             response = self.client.messages.create(
-                model=self.model,
-                max_tokens=2048,
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/png",
-                                "data": annotated_image_base64
-                            }
-                        },
-                        {"type": "text", "text": prompt}
-                    ]
-                }]
+                **self.build_request(annotated_image_base64, filtered_rooms, width, height)
             )
-            
-            response_text = response.content[0].text.strip()
-            
-            # Clean markdown if present
-            if response_text.startswith("```"):
-                response_text = re.sub(r'^```\w*\n?', '', response_text)
-                response_text = re.sub(r'\n?```$', '', response_text)
-            
-            data = json.loads(response_text)
-            buttons = self._process_button_data(
-                data.get("buttons", []),
+            buttons = self.parse_response(
+                response.content[0].text,
                 filtered_rooms,
                 width,
                 height
             )
             
-            # Add fallback buttons for rooms that weren't detected by LLM
-            # Use flexible matching to avoid duplicates (e.g., "Bedroom" vs "Master Bedroom")
-            detected_room_names = {btn['room_data']['name'].upper() for btn in buttons}
-            detected_room_types = {}
-            for btn in buttons:
-                room_type = btn['room_data'].get('type', '')
-                if room_type not in detected_room_types:
-                    detected_room_types[room_type] = []
-                detected_room_types[room_type].append(btn['room_data']['name'].upper())
-            
-            missing_rooms = []
-            for room in filtered_rooms:
-                room_name = room.get('name', '').upper()
-                room_type = room.get('type', '')
-                
-                # Skip if exact name match
-                if room_name in detected_room_names:
-                    continue
-                
-                # Skip if partial name match (e.g., "BEDROOM" in "MASTER BEDROOM")
-                is_partial_match = False
-                for detected_name in detected_room_names:
-                    if room_name in detected_name or detected_name in room_name:
-                        is_partial_match = True
-                        break
-                
-                if not is_partial_match:
-                    missing_rooms.append(room)
-            
-            if missing_rooms:
-                print(f"Adding fallback buttons for {len(missing_rooms)} undetected rooms")
-                fallback_buttons = self._create_fallback_buttons(missing_rooms, width, height)
-                buttons.extend(fallback_buttons)
-            
-            # Check and fix overlapping buttons
-            buttons = self._fix_overlapping_buttons(buttons)
-            
             print(f"Button positions extracted: {len(buttons)} buttons (filtered from {len(rooms_data)} total rooms)")
             return buttons
             
@@ -189,6 +158,148 @@ Do NOT skip rooms - if you see a colored room area, look carefully for its label
             print(f"Button position analysis error: {e}")
             return self._fallback_positions(rooms_data, width, height)
     
+    def filter_rooms(self, rooms_data: List[Dict]) -> List[Dict]:
+        """Drop rooms too small or unimportant to get a button."""
+        filtered_rooms = []
+        for room in rooms_data:
+            room_type = room.get('type', '')
+            if room_type in self.EXCLUDED_TYPES:
+                continue
+            if room.get('area_sqft', 0) >= self.MIN_AREA_SQFT or room_type in self.IMPORTANT_TYPES:
+                filtered_rooms.append(room)
+        return filtered_rooms
+    
+    def build_request(
+        self,
+        annotated_image_base64: str,
+        filtered_rooms: List[Dict],
+        width: int,
+        height: int
+    ) -> Dict:
+        """
+        Build the messages.create parameters for a button position request.
+        
+        Shared by analyze() and batch submissions so both send the same prompt.
+        """
+        # Build room names list for the prompt
+        room_names = [r.get('name', '') for r in filtered_rooms]
+        room_list = ", ".join(f'"{name}"' for name in room_names if name)
+        
+        prompt = _button_prompt(width, height, room_list)
+        
+        return {
+            "model": self.model,
+            "max_tokens": 2048,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": "image/png",
+                            "data": annotated_image_base64
+                        }
+                    },
+                    {"type": "text", "text": prompt}
+                ]
+            }]
+        }
+    
+    def parse_response(
+        self,
+        response_text: str,
+        filtered_rooms: List[Dict],
+        width: int,
+        height: int
+    ) -> List[Dict]:
+        """Turn Claude's button JSON into positioned buttons, filling in undetected rooms."""
+        response_text = response_text.strip()
+        
+        # Clean markdown if present
+        if response_text.startswith("```"):
+            newline = response_text.find("\n")
+            response_text = response_text[newline + 1:] if newline != -1 else response_text[3:]
+            if response_text.endswith("```"):
+                response_text = response_text[:-3]
+        
+        data = orjson.loads(response_text)
+        return self._buttons_from_coordinates(data.get("buttons", []), filtered_rooms, width, height)
+    
+    def from_centroids(
+        self,
+        rooms_data: List[Dict],
+        centroids: List[Dict],
+        width: int,
+        height: int
+    ) -> List[Dict]:
+        """
+        Build buttons from labelled room centroids, without calling Claude.
+        
+        Args:
+            rooms_data: List of room data from floor plan analysis
+            centroids: Dicts with room_name, x and y (pixels), e.g. from
+                RasterScan's segmentation
+            width: Image width in pixels
+            height: Image height in pixels
+        
+        Returns:
+            List of button objects, same shape as analyze()
+        """
+        filtered_rooms = self.filter_rooms(rooms_data)
+        if not filtered_rooms:
+            return []
+        
+        buttons = self._buttons_from_coordinates(centroids, filtered_rooms, width, height)
+        print(f"Button positions from centroids: {len(buttons)} buttons (filtered from {len(rooms_data)} total rooms)")
+        return buttons
+    
+    def _buttons_from_coordinates(
+        self,
+        button_coords: List[Dict],
+        filtered_rooms: List[Dict],
+        width: int,
+        height: int
+    ) -> List[Dict]:
+        """Match labelled pixel coordinates to rooms, add fallbacks for missing rooms and fix overlaps."""
+        buttons = self._process_button_data(
+            button_coords,
+            filtered_rooms,
+            width,
+            height
+        )
+        
+        # Add fallback buttons for rooms that weren't detected by LLM
+        # Use flexible matching to avoid duplicates (e.g., "Bedroom" vs "Master Bedroom")
+        detected_room_names = {btn['room_data']['name'].upper() for btn in buttons}
+        
+        missing_rooms = []
+        for room in filtered_rooms:
+            room_name = room.get('name', '').upper()
+            
+            # Skip if exact name match
+            if room_name in detected_room_names:
+                continue
+            
+            # Skip if partial name match (e.g., "BEDROOM" in "MASTER BEDROOM")
+            is_partial_match = False
+            for detected_name in detected_room_names:
+                if room_name in detected_name or detected_name in room_name:
+                    is_partial_match = True
+                    break
+            
+            if not is_partial_match:
+                missing_rooms.append(room)
+        
+        if missing_rooms:
+            print(f"Adding fallback buttons for {len(missing_rooms)} undetected rooms")
+            fallback_buttons = self._create_fallback_buttons(missing_rooms, width, height)
+            buttons.extend(fallback_buttons)
+        
+        # Check and fix overlapping buttons
+        buttons = self._fix_overlapping_buttons(buttons)
+        return buttons
+    
     def _process_button_data(
         self,
         button_coords: List[Dict],
@@ -233,38 +344,22 @@ Do NOT skip rooms - if you see a colored room area, look carefully for its label
     def _find_matching_room(self, room_name: str, rooms_data: List[Dict]) -> Optional[Dict]:
         """Find room data matching the given name (flexible matching)."""
         room_name_upper = room_name.upper().strip()
+        stored_names = [room.get('name', '').upper().strip() for room in rooms_data]
         
         # Exact match first
-        for room in rooms_data:
-            if room.get('name', '').upper().strip() == room_name_upper:
-                return room
+        if room_name_upper in stored_names:
+            return rooms_data[stored_names.index(room_name_upper)]
         
         # Partial match (room name contains or is contained)
-        for room in rooms_data:
-            room_stored = room.get('name', '').upper().strip()
+        for room, room_stored in zip(rooms_data, stored_names):
             if room_name_upper in room_stored or room_stored in room_name_upper:
                 return room
         
         # Match by type keyword
-        type_keywords = {
-            'LIVING': 'living_room',
-            'BEDROOM': 'bedroom',
-            'MASTER': 'bedroom',
-            'KITCHEN': 'kitchen',
-            'DINING': 'dining_room',
-            'BATH': 'bathroom',
-            'CLOSET': 'closet',
-            'OFFICE': 'office',
-            'GARAGE': 'garage',
-            'HALLWAY': 'hallway',
-            'ENTRANCE': 'entrance'
-        }
-        
-        for keyword, room_type in type_keywords.items():
-            if keyword in room_name_upper:
-                for room in rooms_data:
-                    if room.get('type') == room_type:
-                        return room
+        for room_type in _keyword_room_types(room_name_upper):
+            for room in rooms_data:
+                if room.get('type') == room_type:
+                    return room
         
         return None
     
@@ -273,13 +368,16 @@ Do NOT skip rooms - if you see a colored room area, look carefully for its label
         Detect and fix overlapping buttons by adjusting their positions.
         Assumes average button size of ~15% width x 8% height.
         """
-        BUTTON_WIDTH = 15.0  # Approximate button width in percentage
-        BUTTON_HEIGHT = 8.0  # Approximate button height in percentage
-        MIN_SPACING = 2.0    # Minimum spacing between buttons
+        # Placed buttons are bucketed into cells the size of the overlap
+        # distance, so any button close enough to overlap is in the same
+        # or an adjacent cell
+        CELL_WIDTH = self.BUTTON_WIDTH + self.MIN_SPACING
+        CELL_HEIGHT = self.BUTTON_HEIGHT + self.MIN_SPACING
+        grid: Dict[tuple, List[tuple]] = {}
         
         fixed_buttons = []
         
-        for i, button in enumerate(buttons):
+        for button in buttons:
             x = button['x_percent']
             y = button['y_percent']
             
@@ -291,40 +389,53 @@ Do NOT skip rooms - if you see a colored room area, look carefully for its label
             while overlaps and attempts < max_attempts:
                 overlaps = False
                 
-                for placed_button in fixed_buttons:
-                    px = placed_button['x_percent']
-                    py = placed_button['y_percent']
+                # The earliest placed overlapping button decides which way
+                # this one moves, so find the lowest index among neighbours
+                cell_x = int(x // CELL_WIDTH)
+                cell_y = int(y // CELL_HEIGHT)
+                first = None
+                for gx in (cell_x - 1, cell_x, cell_x + 1):
+                    for gy in (cell_y - 1, cell_y, cell_y + 1):
+                        for index, px, py in grid.get((gx, gy), ()):
+                            # Check if buttons overlap (with spacing)
+                            if (
+                                (first is None or index < first[0])
+                                and abs(x - px) < CELL_WIDTH
+                                and abs(y - py) < CELL_HEIGHT
+                            ):
+                                first = (index, px, py)
+                
+                if first is not None:
+                    overlaps = True
+                    _, px, py = first
                     
                     # Calculate distance between button centers
                     dx = abs(x - px)
                     dy = abs(y - py)
                     
-                    # Check if buttons overlap (with spacing)
-                    if dx < (BUTTON_WIDTH + MIN_SPACING) and dy < (BUTTON_HEIGHT + MIN_SPACING):
-                        overlaps = True
-                        
-                        # Adjust position - move away from overlapping button
-                        if dx < dy:
-                            # Move horizontally
-                            if x < px:
-                                x = max(5.0, x - 10.0)
-                            else:
-                                x = min(95.0, x + 10.0)
+                    # Adjust position - move away from overlapping button
+                    if dx < dy:
+                        # Move horizontally
+                        if x < px:
+                            x = max(5.0, x - 10.0)
                         else:
-                            # Move vertically
-                            if y < py:
-                                y = max(5.0, y - 10.0)
-                            else:
-                                y = min(95.0, y + 10.0)
-                        
-                        print(f"  Adjusting '{button['room_data']['name']}' to avoid overlap: ({x:.1f}%, {y:.1f}%)")
-                        break
+                            x = min(95.0, x + 10.0)
+                    else:
+                        # Move vertically
+                        if y < py:
+                            y = max(5.0, y - 10.0)
+                        else:
+                            y = min(95.0, y + 10.0)
+                    
+                    print(f"  Adjusting '{button['room_data']['name']}' to avoid overlap: ({x:.1f}%, {y:.1f}%)")
                 
                 attempts += 1
             
             # Update button position
             button['x_percent'] = round(x, 2)
             button['y_percent'] = round(y, 2)
+            cell = (int(button['x_percent'] // CELL_WIDTH), int(button['y_percent'] // CELL_HEIGHT))
+            grid.setdefault(cell, []).append((len(fixed_buttons), button['x_percent'], button['y_percent']))
             fixed_buttons.append(button)
         
         return fixed_buttons
@@ -0,0 +1,24 @@
+"""
+Shared Claude Client
+
+Every anthropic.Anthropic client owns its own HTTP connection pool, so the
+services share one client per API key instead of building a pool for
+each analyzer or agent instance.
+"""
+
+from functools import lru_cache
+import anthropic
+
+
+@lru_cache(maxsize=None)
+def get_claude_client(api_key: str) -> anthropic.Anthropic:
+    """
+    Return the process-wide synchronous Claude client for an API key.
+    
+    Args:
+        api_key: Anthropic API key
+    
+    Returns:
+        Client shared by every caller using the same key
+    """
+    return anthropic.Anthropic(api_key=api_key)
@@ -10,20 +10,79 @@ Output:
   - JSON with detailed room parameters
 """
 
-import base64
 import io
-import json
-import re
+import asyncio
+import hashlib
 import os
+import threading
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
-from PIL import Image
+import numpy as np
+import orjson
+from PIL import Image, ImageChops
+import pybase64
 import httpx
 import anthropic
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from .button_position_analyzer import analyze_button_positions
+from .button_position_analyzer import ButtonPositionAnalyzer, analyze_button_positions
 
 load_dotenv()
 
+# RasterScan result: RGB overlay, room mask (255 on room pixels) and any
+# labelled room centroids ({"room_name", "x", "y"} in image pixels)
+RasterScanOverlay = Tuple[Image.Image, Image.Image, List[Dict]]
+
+# Lookup tables for the overlay room mask: a pixel belongs to a room unless
+# it is near-white (background) or near-black (walls)
+_NOT_WHITE_LUT = [0 if v > 240 else 255 for v in range(256)]
+_NOT_BLACK_LUT = [0 if v < 50 else 255 for v in range(256)]
+
+
+@lru_cache(maxsize=256)
+def _room_prompt(width: int, height: int, context: Optional[str]) -> str:
+    """Room extraction prompt; repeat sizes and contexts reuse the built string."""
+    context_hint = f"\nContext: This is a {context}." if context else ""
+    
+    prompt = f"""Analyze this floor plan image ({width}x{height} pixels).{context_hint}
+
+Extract information about EVERY room/space in the floor plan.
+
+For each room provide:
+1. name: Room name (read from labels or infer from fixtures)
+2. type: Category (bedroom, bathroom, kitchen, living_room, dining_room, office, entrance, hallway, closet, storage, utility, garage, balcony, other)
+3. area_sqft: Area in square feet (read or estimate)
+4. area_sqm: Area in square meters
+5. dimensions: Object with length, width (imperial and metric)
+6. fixtures: List of fixtures/furniture visible
+7. doors: List of doors with position and connection
+8. windows: List of windows with position and count
+9. adjacent_rooms: List of connected room names
+
+Return ONLY valid JSON (no markdown, no explanation):
+
+{{"rooms": [
+  {{
+    "name": "Living Room",
+    "type": "living_room",
+    "area_sqft": 208,
+    "area_sqm": 19.3,
+    "dimensions": {{
+      "length": "15'4\\"",
+      "width": "13'6\\"",
+      "length_m": 4.7,
+      "width_m": 4.1
+    }},
+    "fixtures": ["window", "door"],
+    "doors": [{{"position": "south", "type": "standard", "connects_to": "entrance"}}],
+    "windows": [{{"position": "north", "count": 2, "type": "standard"}}],
+    "adjacent_rooms": ["kitchen", "entrance"]
+  }}
+]}}
+
+Include ALL rooms. Be precise with dimensions shown in the plan."""
+    return prompt
+
 
 class FloorPlanAnalyzer:
     """
@@ -38,13 +97,32 @@ class FloorPlanAnalyzer:
         # - "annotated_image_base64": base64 encoded PNG with overlays
         # - "total_area_sqft": total floor area
         # - "room_count": number of rooms detected
+    
+    Successful results are cached by the SHA-256 of the image content and
+    context, so repeat uploads of the same file skip the Claude and
+    RasterScan calls.
     """
     
+    # Message Batches accept up to 256MB per batch; leave headroom for
+    # prompts and JSON framing around the base64 images
+    BATCH_MAX_IMAGE_BYTES = 200 * 1024 * 1024
+    
+    # Claude scales images down to a 1568px long edge anyway, so larger
+    # inputs are shrunk before upload to save bandwidth
+    MAX_INPUT_EDGE = 1568
+    
+    # RasterScan segmentation of large plans can take a while
+    RASTERSCAN_TIMEOUT = 60.0
+    
+    # RasterScan calls in flight at once during batch analysis
+    MAX_CONCURRENT_RASTERSCAN = 8
+    
     def __init__(
         self,
         rasterscan_api_key: Optional[str] = None,
         claude_api_key: Optional[str] = None,
-        overlay_alpha: int = 140
+        overlay_alpha: int = 140,
+        http_client: Optional[httpx.AsyncClient] = None
     ):
         self.rasterscan_url = "https://backend.rasterscan.com/raster-to-vector-base64"
         self.rasterscan_api_key = rasterscan_api_key or os.getenv("RASTERSCAN_API_KEY")
@@ -52,15 +130,26 @@ class FloorPlanAnalyzer:
         self.overlay_alpha = overlay_alpha
         self.model = "claude-sonnet-4-20250514"
         
+        # Pooled client for RasterScan calls; an owned one is created on
+        # first use when none is shared in, and closed by aclose()
+        self.http_client = http_client
+        self._owns_http_client = False
+        
+        # Results hold the annotated PNG, so keep the cache small. Lookups
+        # happen in worker threads, so access goes through the lock.
+        self._cache = TTLCache(maxsize=32, ttl=24 * 3600)
+        self._cache_lock = threading.Lock()
+        
         if self.claude_api_key:
-            self.claude_client = anthropic.Anthropic(api_key=self.claude_api_key)
+            self.claude_client = anthropic.AsyncAnthropic(api_key=self.claude_api_key)
         else:
             self.claude_client = None
     
     async def analyze(
         self, 
         image_bytes: bytes, 
-        context: Optional[str] = None
+        context: Optional[str] = None,
+        return_image: str = "base64"
     ) -> Dict:
         """
         Analyze a floor plan image.
@@ -68,181 +157,526 @@ class FloorPlanAnalyzer:
         Args:
             image_bytes: Raw image bytes (PNG, JPEG, etc.)
             context: Optional context hint (e.g., "residential apartment", "office")
+            return_image: How to return the annotated image - "base64",
+                "bytes" (raw PNG in annotated_image_bytes) or "none"
         
         Returns:
             Dict with:
                 - status: "success" or "error"
                 - rooms: List of room dictionaries with parameters
                 - annotated_image_base64: Base64 encoded PNG with room overlays
+                  (None unless return_image is "base64")
                 - total_area_sqft: Total floor area in square feet
                 - room_count: Number of rooms detected
         """
         try:
-            original_image = Image.open(io.BytesIO(image_bytes))
-
-            # Detect media type from image format
-            img_format = original_image.format
-            format_to_media_type = {
-                'PNG': 'image/png',
-                'JPEG': 'image/jpeg',
-                'JPG': 'image/jpeg',
-                'GIF': 'image/gif',
-                'WEBP': 'image/webp',
-            }
-            media_type = format_to_media_type.get(img_format, 'image/png')
-
-            if original_image.mode != 'RGBA':
-                original_image = original_image.convert('RGBA')
-
-            width, height = original_image.size
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            # Hashing, decoding and downscaling are CPU-bound; keep them off
+            # the event loop
+            job = await asyncio.to_thread(self._prepare, image_bytes, context)
+            if job["cached"] is not None:
+                return self._build_result(*job["cached"], return_image)
+            
+            original_image = job["image"]
+            width, height = job["width"], job["height"]
+            image_base64 = job["image_base64"]
+            input_width, input_height = job["input_size"]
             
-            # Get RasterScan overlay
-            print(f"Requesting RasterScan overlay for {width}x{height} image...")
-            rasterscan_image = await self._get_rasterscan_overlay(
-                image_base64, 
-                original_image.size
+            # Get RasterScan overlay and room data from Claude concurrently.
+            # Both coroutines handle their own errors, so neither cancels the other.
+            print(f"Requesting RasterScan overlay for {input_width}x{input_height} image...")
+            rasterscan_image, rooms_data = await asyncio.gather(
+                self._get_rasterscan_overlay(image_base64, original_image.size),
+                self._analyze_with_claude(image_base64, input_width, input_height, context, job["media_type"])
             )
             print(f"RasterScan overlay: {'received' if rasterscan_image else 'failed/none'}")
             
-            # Get room data from Claude
-            rooms_data = self._analyze_with_claude(image_base64, width, height, context, media_type)
-            
-            # Filter out small rooms (closets, storage) - only keep rooms >= 30 sqft
-            MIN_ROOM_SIZE_SQFT = 30
-            filtered_rooms = [
-                room for room in rooms_data 
-                if room.get('area_sqft', 0) >= MIN_ROOM_SIZE_SQFT
-            ]
-            
-            excluded_count = len(rooms_data) - len(filtered_rooms)
-            if excluded_count > 0:
-                print(f"Filtered out {excluded_count} small rooms (<{MIN_ROOM_SIZE_SQFT} sqft)")
-                excluded_names = [r.get('name', 'Unknown') for r in rooms_data if r.get('area_sqft', 0) < MIN_ROOM_SIZE_SQFT]
-                print(f"Excluded rooms: {', '.join(excluded_names)}")
+            complete = self._is_complete(rooms_data, rasterscan_image)
+            rooms_data = self._filter_small_rooms(rooms_data)
             
-            rooms_data = filtered_rooms
-            
-            # Create annotated image
-            annotated_image = self._create_annotated_image(
-                original_image, 
-                rasterscan_image
+            annotated_png, button_base64, button_size = await asyncio.to_thread(
+                self._render, original_image, rasterscan_image
             )
             
-            # Encode output image
-            output_buffer = io.BytesIO()
-            annotated_image.save(output_buffer, format='PNG')
-            annotated_base64 = base64.b64encode(output_buffer.getvalue()).decode('utf-8')
+            centroids = rasterscan_image[2] if rasterscan_image else []
+            if centroids:
+                # RasterScan already labelled the rooms; no need to ask Claude
+                room_buttons = ButtonPositionAnalyzer().from_centroids(rooms_data, centroids, width, height)
+            else:
+                # Extract button positions using separate LLM analyzer.
+                # Positions come back as percentages, so a downscaled copy works.
+                print("Extracting button positions from annotated image...")
+                room_buttons = await asyncio.to_thread(
+                    analyze_button_positions,
+                    button_base64,
+                    rooms_data,
+                    *button_size
+                )
             
-            # Extract button positions using separate LLM analyzer
-            print("Extracting button positions from annotated image...")
-            room_buttons = analyze_button_positions(
-                annotated_base64,
-                rooms_data,
-                width,
-                height
-            )
+            entry = self._store(job, rooms_data, room_buttons, annotated_png, complete)
+            full_base64 = button_base64 if button_size == (width, height) else None
+            return self._build_result(*entry, return_image, full_base64)
             
-            # Calculate total area
-            total_area = sum(r.get('area_sqft', 0) for r in rooms_data)
+        except Exception as e:
+            return self._error_result(e)
+    
+    async def analyze_batch(
+        self,
+        images: List[bytes],
+        context: Optional[str] = None,
+        poll_interval: float = 30.0
+    ) -> List[Dict]:
+        """
+        Analyze many floor plans through the Message Batches API.
+        
+        Meant for bulk ingestion rather than interactive requests: batched
+        Claude calls cost half as much but can take minutes to complete.
+        Room extraction for all images goes out as one batch, then button
+        positioning for all annotated images as a second one.
+        
+        Args:
+            images: Raw image bytes for each floor plan
+            context: Optional context hint applied to every plan
+            poll_interval: Seconds between batch status checks
+        
+        Returns:
+            One result per input image, in order, shaped like analyze()
+            with return_image="base64"
+        """
+        if not self.claude_client:
+            return [await self.analyze(image_bytes, context) for image_bytes in images]
+        
+        jobs = []
+        pending: Dict[str, Dict] = {}  # cache key -> job, also the batch custom_id
+        
+        for image_bytes in images:
+            try:
+                job = await asyncio.to_thread(self._prepare, image_bytes, context)
+            except Exception as e:
+                job = {"result": self._error_result(e)}
+            else:
+                if job["cached"] is not None:
+                    job["result"] = self._build_result(*job["cached"], "base64")
+                else:
+                    # Identical images share one job
+                    job = pending.setdefault(job["cache_key"], job)
+            jobs.append(job)
+        
+        if pending:
+            try:
+                await self._analyze_pending_batch(list(pending.values()), context, poll_interval)
+            except Exception as e:
+                print(f"Batch analysis error: {e}")
+                for job in pending.values():
+                    job.setdefault("result", self._error_result(e))
+        
+        return [job["result"] for job in jobs]
+    
+    async def _analyze_pending_batch(
+        self,
+        jobs: List[Dict],
+        context: Optional[str],
+        poll_interval: float
+    ):
+        """Run the analysis pipeline for uncached jobs, setting job["result"] on each."""
+        print(f"Batch analyzing {len(jobs)} floor plans...")
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_RASTERSCAN)
+        
+        async def get_overlay(job: Dict) -> Optional[RasterScanOverlay]:
+            async with semaphore:
+                return await self._get_rasterscan_overlay(job["image_base64"], job["image"].size)
+        
+        overlays = await asyncio.gather(*(get_overlay(job) for job in jobs))
+        
+        room_texts = await self._run_batch(
+            {
+                job["cache_key"]: self._room_request(
+                    job["image_base64"], *job["input_size"], context, job["media_type"]
+                )
+                for job in jobs
+            },
+            poll_interval
+        )
+        
+        button_analyzer = ButtonPositionAnalyzer()
+        button_requests = {}
+        for job, overlay in zip(jobs, overlays):
+            key = job["cache_key"]
+            try:
+                rooms_data = self._parse_rooms(room_texts[key])
+            except Exception as e:
+                print(f"Claude batch error for {key[:12]}: {e}")
+                rooms_data = []
             
-            return {
-                "status": "success",
-                "rooms": rooms_data,
-                "room_buttons": room_buttons,
-                "annotated_image_base64": annotated_base64,
-                "image_dimensions": {"width": width, "height": height},
-                "total_area_sqft": total_area,
-                "room_count": len(rooms_data)
-            }
+            job["complete"] = self._is_complete(rooms_data, overlay)
+            job["rooms"] = self._filter_small_rooms(rooms_data)
+            job["annotated_png"], button_base64, job["button_size"] = await asyncio.to_thread(
+                self._render, job["image"], overlay
+            )
+            job["centroids"] = overlay[2] if overlay else []
+            job["button_rooms"] = button_analyzer.filter_rooms(job["rooms"])
+            if job["button_rooms"] and not job["centroids"]:
+                button_requests[key] = button_analyzer.build_request(
+                    button_base64, job["button_rooms"], *job["button_size"]
+                )
+        
+        button_texts = await self._run_batch(button_requests, poll_interval) if button_requests else {}
+        
+        for job in jobs:
+            key = job["cache_key"]
+            room_buttons = []
+            if job["centroids"]:
+                room_buttons = button_analyzer.from_centroids(
+                    job["rooms"], job["centroids"], job["width"], job["height"]
+                )
+            elif job["button_rooms"]:
+                try:
+                    room_buttons = button_analyzer.parse_response(
+                        button_texts[key], job["button_rooms"], *job["button_size"]
+                    )
+                except Exception as e:
+                    print(f"Button position batch error for {key[:12]}: {e}")
+                    room_buttons = button_analyzer._fallback_positions(
+                        job["rooms"], job["width"], job["height"]
+                    )
             
-        except Exception as e:
-            return {
-                "status": "error",
-                "error": str(e),
-                "rooms": [],
-                "room_buttons": [],
-                "annotated_image_base64": None,
-                "image_dimensions": {"width": 0, "height": 0},
-                "total_area_sqft": 0,
-                "room_count": 0
-            }
+            entry = self._store(job, job["rooms"], room_buttons, job["annotated_png"], job["complete"])
+            job["result"] = self._build_result(*entry, "base64")
+    
+    async def _run_batch(self, requests: Dict[str, Dict], poll_interval: float) -> Dict[str, str]:
+        """
+        Submit messages.create parameters through the Message Batches API.
+        
+        Requests are split into several batches when their images would
+        exceed the batch size limit; the batches run concurrently.
+        
+        Returns:
+            Response text keyed by custom_id, for requests that succeeded
+        """
+        groups = [[]]
+        group_bytes = 0
+        for custom_id, params in requests.items():
+            size = sum(
+                len(block["source"]["data"])
+                for block in params["messages"][0]["content"]
+                if block["type"] == "image"
+            )
+            if groups[-1] and group_bytes + size > self.BATCH_MAX_IMAGE_BYTES:
+                groups.append([])
+                group_bytes = 0
+            groups[-1].append({"custom_id": custom_id, "params": params})
+            group_bytes += size
+        
+        texts = {}
+        for group_texts in await asyncio.gather(*(
+            self._run_single_batch(group, poll_interval) for group in groups
+        )):
+            texts.update(group_texts)
+        return texts
+    
+    async def _run_single_batch(self, requests: List[Dict], poll_interval: float) -> Dict[str, str]:
+        """Submit one message batch, poll until it ends, and collect response text."""
+        batches = self.claude_client.messages.batches
+        batch = await batches.create(requests=requests)
+        print(f"Submitted message batch {batch.id} with {len(requests)} requests")
+        
+        while batch.processing_status != "ended":
+            await asyncio.sleep(poll_interval)
+            batch = await batches.retrieve(batch.id)
+        
+        texts = {}
+        async for entry in await batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                texts[entry.custom_id] = entry.result.message.content[0].text
+            else:
+                print(f"Batch request {entry.custom_id[:12]} {entry.result.type}")
+        return texts
+    
+    def _prepare(self, image_bytes: bytes, context: Optional[str]) -> Dict:
+        """
+        Look an upload up in the cache, decoding it on a miss.
+        
+        Returns:
+            Job dict with cache_key and cached (a cache entry or None). On a
+            miss it also holds the decoded image, its size, media type and
+            base64 encoding.
+        """
+        hasher = hashlib.sha256(image_bytes)
+        hasher.update(b"\0" + (context or "").encode())
+        cache_key = hasher.hexdigest()
+        
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+        if cached is not None:
+            print(f"Analysis cache hit: {cache_key[:12]}")
+            return {"cache_key": cache_key, "cached": cached}
+        
+        original_image = Image.open(io.BytesIO(image_bytes))
+        
+        # Detect media type from image format
+        format_to_media_type = {
+            'PNG': 'image/png',
+            'JPEG': 'image/jpeg',
+            'JPG': 'image/jpeg',
+            'GIF': 'image/gif',
+            'WEBP': 'image/webp',
+        }
+        media_type = format_to_media_type.get(original_image.format, 'image/png')
+        width, height = original_image.size
+        
+        # Send a downscaled copy to RasterScan and Claude when oversized
+        input_image = self._downscale(original_image)
+        if input_image is None:
+            input_image = original_image
+            image_base64 = pybase64.b64encode_as_string(image_bytes)
+        else:
+            print(f"Downscaled {width}x{height} input to {input_image.width}x{input_image.height}")
+            buffer = io.BytesIO()
+            if media_type == 'image/jpeg':
+                input_image.convert('RGB').save(buffer, format='JPEG', quality=90)
+            else:
+                input_image.save(buffer, format='PNG', compress_level=1)
+                media_type = 'image/png'
+            with buffer.getbuffer() as view:
+                image_base64 = pybase64.b64encode_as_string(view)
+        
+        return {
+            "cache_key": cache_key,
+            "cached": None,
+            "image": original_image,
+            "width": width,
+            "height": height,
+            "input_size": input_image.size,
+            "media_type": media_type,
+            "image_base64": image_base64,
+        }
+    
+    def _filter_small_rooms(self, rooms_data: List[Dict]) -> List[Dict]:
+        """Filter out small rooms (closets, storage) - only keep rooms >= 30 sqft."""
+        MIN_ROOM_SIZE_SQFT = 30
+        filtered_rooms = [
+            room for room in rooms_data 
+            if room.get('area_sqft', 0) >= MIN_ROOM_SIZE_SQFT
+        ]
+        
+        excluded_count = len(rooms_data) - len(filtered_rooms)
+        if excluded_count > 0:
+            print(f"Filtered out {excluded_count} small rooms (<{MIN_ROOM_SIZE_SQFT} sqft)")
+            excluded_names = [r.get('name', 'Unknown') for r in rooms_data if r.get('area_sqft', 0) < MIN_ROOM_SIZE_SQFT]
+            print(f"Excluded rooms: {', '.join(excluded_names)}")
+        
+        return filtered_rooms
+    
+    def _render(
+        self,
+        original_image: Image.Image,
+        rasterscan_image: Optional[RasterScanOverlay]
+    ) -> Tuple[bytes, str, Tuple[int, int]]:
+        """
+        Create the annotated image.
+        
+        Returns:
+            Full-size PNG bytes, plus the base64 PNG and size of the copy
+            sent to Claude for button positioning (downscaled if oversized)
+        """
+        annotated_image = self._create_annotated_image(
+            original_image, 
+            rasterscan_image
+        )
+        
+        # Encode output image. zlib level 1 is cheaper to encode than
+        # PIL's default and costs little size on flat overlay colors.
+        output_buffer = io.BytesIO()
+        annotated_image.save(output_buffer, format='PNG', compress_level=1)
+        annotated_png = output_buffer.getvalue()
+        
+        button_image = self._downscale(annotated_image)
+        if button_image is None:
+            return annotated_png, pybase64.b64encode_as_string(annotated_png), annotated_image.size
+        
+        # Only the base64 of this copy is needed, so encode straight from
+        # the buffer instead of copying it out first
+        button_buffer = io.BytesIO()
+        button_image.save(button_buffer, format='PNG', compress_level=1)
+        with button_buffer.getbuffer() as view:
+            button_base64 = pybase64.b64encode_as_string(view)
+        return annotated_png, button_base64, button_image.size
+    
+    def _downscale(self, image: Image.Image) -> Optional[Image.Image]:
+        """Shrink an image to MAX_INPUT_EDGE on its long side, or return None if it fits."""
+        width, height = image.size
+        scale = self.MAX_INPUT_EDGE / max(width, height)
+        if scale >= 1.0:
+            return None
+        
+        # Palette and other modes only resize with nearest-neighbour
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA')
+        
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return image.resize(size, Image.Resampling.LANCZOS)
+    
+    def _store(
+        self,
+        job: Dict,
+        rooms_data: List[Dict],
+        room_buttons: List[Dict],
+        annotated_png: bytes,
+        cacheable: bool
+    ) -> Tuple:
+        """Build a successful result, caching it with the annotated PNG when cacheable."""
+        result = {
+            "status": "success",
+            "rooms": rooms_data,
+            "room_buttons": room_buttons,
+            "annotated_image_base64": None,
+            "image_dimensions": {"width": job["width"], "height": job["height"]},
+            "total_area_sqft": sum(r.get('area_sqft', 0) for r in rooms_data),
+            "room_count": len(rooms_data)
+        }
+        
+        entry = (result, annotated_png)
+        if cacheable:
+            with self._cache_lock:
+                self._cache[job["cache_key"]] = entry
+        else:
+            print(f"Incomplete analysis, not cached: {job['cache_key'][:12]}")
+        return entry
+    
+    def _is_complete(
+        self,
+        rooms_data: List[Dict],
+        rasterscan_image: Optional[RasterScanOverlay]
+    ) -> bool:
+        """Whether Claude returned rooms and, when configured, RasterScan an overlay."""
+        return bool(rooms_data) and (rasterscan_image is not None or not self.rasterscan_api_key)
+    
+    def _error_result(self, error: Exception) -> Dict:
+        """Result returned when analysis fails."""
+        return {
+            "status": "error",
+            "error": str(error),
+            "rooms": [],
+            "room_buttons": [],
+            "annotated_image_base64": None,
+            "image_dimensions": {"width": 0, "height": 0},
+            "total_area_sqft": 0,
+            "room_count": 0
+        }
+    
+    def _build_result(
+        self,
+        result: Dict,
+        annotated_png: bytes,
+        return_image: str,
+        annotated_base64: Optional[str] = None
+    ) -> Dict:
+        """Copy a cached result, attaching the annotated image in the requested form."""
+        result = dict(result)
+        if return_image == "base64":
+            result["annotated_image_base64"] = (
+                annotated_base64 or pybase64.b64encode_as_string(annotated_png)
+            )
+        elif return_image == "bytes":
+            result["annotated_image_bytes"] = annotated_png
+        return result
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Return the pooled HTTP client, creating an owned one on first use."""
+        if self.http_client is None:
+            self.http_client = httpx.AsyncClient(http2=True, timeout=self.RASTERSCAN_TIMEOUT)
+            self._owns_http_client = True
+        return self.http_client
+    
+    async def aclose(self):
+        """Close the HTTP client if this analyzer created it."""
+        if self._owns_http_client and self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+            self._owns_http_client = False
     
     async def _get_rasterscan_overlay(
         self, 
         image_base64: str, 
         target_size: Tuple[int, int]
-    ) -> Optional[Image.Image]:
-        """Get room segmentation overlay from RasterScan API."""
+    ) -> Optional[RasterScanOverlay]:
+        """
+        Get room segmentation overlay from RasterScan API.
+        
+        Returns:
+            (RGB overlay, room mask, room centroids) at target_size, where
+            the mask is 255 on room pixels and 0 elsewhere, or None on failure
+        """
         if not self.rasterscan_api_key:
             return None
         
         try:
             print(f"Calling RasterScan API: {self.rasterscan_url}")
             print(f"API key present: {bool(self.rasterscan_api_key)}")
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    self.rasterscan_url,
-                    headers={
-                        "Content-Type": "application/json",
-                        "x-api-key": self.rasterscan_api_key
-                    },
-                    json={"image": image_base64}
-                )
-                
-                print(f"RasterScan response status: {response.status_code}")
-                if response.status_code != 200:
-                    print(f"RasterScan API error: {response.text[:500]}")
-                    return None
-                
-                result = response.json()
-                print(f"RasterScan response keys: {list(result.keys())}")
-                
-                # RasterScan returns: {"message": "...", "data": {"image": "base64...", ...}}
-                data = result.get("data", {})
-                highlighted_b64 = data.get("image")
-                
-                if not highlighted_b64:
-                    print(f"No 'image' in data. Available keys: {list(data.keys())}")
-                    return None
-                
-                print(f"RasterScan overlay image received, size: {len(highlighted_b64)} chars")
-                
-                # RasterScan returns data URI format: "data:image/jpg;base64,<base64_data>"
-                if highlighted_b64.startswith('data:'):
-                    # Extract base64 data after the comma
-                    highlighted_b64 = highlighted_b64.split(',', 1)[1]
-                
-                # Fix base64 padding if needed
-                missing_padding = len(highlighted_b64) % 4
-                if missing_padding:
-                    highlighted_b64 += '=' * (4 - missing_padding)
-                
-                rs_bytes = base64.b64decode(highlighted_b64)
-                rs_image = Image.open(io.BytesIO(rs_bytes)).convert('RGBA')
-                
-                if rs_image.size != target_size:
-                    rs_image = rs_image.resize(target_size, Image.Resampling.LANCZOS)
-                
-                # Apply transparency
-                pixels = rs_image.load()
-                for y in range(rs_image.height):
-                    for x in range(rs_image.width):
-                        r, g, b, a = pixels[x, y]
-                        if r > 240 and g > 240 and b > 240:
-                            pixels[x, y] = (r, g, b, 0)
-                        elif r < 50 and g < 50 and b < 50:
-                            pixels[x, y] = (r, g, b, 0)
-                        else:
-                            pixels[x, y] = (r, g, b, self.overlay_alpha)
-                
-                return rs_image
-                
+            response = await self._get_http_client().post(
+                self.rasterscan_url,
+                headers={
+                    "Content-Type": "application/json",
+                    "x-api-key": self.rasterscan_api_key
+                },
+                content=orjson.dumps({"image": image_base64}),
+                timeout=self.RASTERSCAN_TIMEOUT
+            )
+            
+            print(f"RasterScan response status: {response.status_code}")
+            if response.status_code != 200:
+                print(f"RasterScan API error: {response.text[:500]}")
+                return None
+            
+            result = orjson.loads(response.content)
+            print(f"RasterScan response keys: {list(result.keys())}")
+            
+            # RasterScan returns: {"message": "...", "data": {"image": "base64...", ...}}
+            data = result.get("data", {})
+            highlighted_b64 = data.get("image")
+            
+            if not highlighted_b64:
+                print(f"No 'image' in data. Available keys: {list(data.keys())}")
+                return None
+            
+            print(f"RasterScan overlay image received, size: {len(highlighted_b64)} chars")
+            
+            # RasterScan returns data URI format: "data:image/jpg;base64,<base64_data>".
+            # Work on one bytearray copy: dropping the prefix from the front of
+            # a bytearray and appending padding don't copy the payload again.
+            data_start = highlighted_b64.find(',') + 1 if highlighted_b64.startswith('data:') else 0
+            encoded = bytearray(highlighted_b64, 'ascii')
+            del encoded[:data_start]
+            
+            # Fix base64 padding if needed
+            encoded += b'=' * (-len(encoded) % 4)
+            
+            rs_bytes = pybase64.b64decode(encoded, validate=False)
+            rs_image = Image.open(io.BytesIO(rs_bytes)).convert('RGB')
+            
+            centroids = self._parse_regions(data, rs_image.size, target_size)
+            
+            if rs_image.size != target_size:
+                rs_image = rs_image.resize(target_size, Image.Resampling.LANCZOS)
+            
+            # White background and black walls stay clear; every other
+            # pixel belongs to a room and gets the overlay color. A pixel is
+            # white/black when its darkest/brightest channel is, so threshold
+            # those single 8-bit bands through the lookup tables.
+            red, green, blue = rs_image.split()
+            darkest = ImageChops.darker(ImageChops.darker(red, green), blue)
+            brightest = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+            room_mask = ImageChops.darker(
+                darkest.point(_NOT_WHITE_LUT),
+                brightest.point(_NOT_BLACK_LUT)
+            )
+            
+            return rs_image, room_mask, centroids
+            
         except Exception as e:
             print(f"RasterScan error: {e}")
             return None
     
-    def _analyze_with_claude(
+    async def _analyze_with_claude(
         self,
         image_base64: str,
         width: int,
@@ -254,92 +688,139 @@ class FloorPlanAnalyzer:
         if not self.claude_client:
             return []
         
-        context_hint = f"\nContext: This is a {context}." if context else ""
-        
-        prompt = f"""Analyze this floor plan image ({width}x{height} pixels).{context_hint}
-
-Extract information about EVERY room/space in the floor plan.
-
-For each room provide:
-1. name: Room name (read from labels or infer from fixtures)
-2. type: Category (bedroom, bathroom, kitchen, living_room, dining_room, office, entrance, hallway, closet, storage, utility, garage, balcony, other)
-3. area_sqft: Area in square feet (read or estimate)
-4. area_sqm: Area in square meters
-5. dimensions: Object with length, width (imperial and metric)
-6. fixtures: List of fixtures/furniture visible
-7. doors: List of doors with position and connection
-8. windows: List of windows with position and count
-9. adjacent_rooms: List of connected room names
-
-Return ONLY valid JSON (no markdown, no explanation):
-
-{{"rooms": [
-  {{
-    "name": "Living Room",
-    "type": "living_room",
-    "area_sqft": 208,
-    "area_sqm": 19.3,
-    "dimensions": {{
-      "length": "15'4\\"",
-      "width": "13'6\\"",
-      "length_m": 4.7,
-      "width_m": 4.1
-    }},
-    "fixtures": ["window", "door"],
-    "doors": [{{"position": "south", "type": "standard", "connects_to": "entrance"}}],
-    "windows": [{{"position": "north", "count": 2, "type": "standard"}}],
-    "adjacent_rooms": ["kitchen", "entrance"]
-  }}
-]}}
-
-Include ALL rooms. Be precise with dimensions shown in the plan."""
-
         try:
-            response = self.claude_client.messages.create(
-                model=self.model,
-                max_tokens=4096,
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_base64
-                            }
-                        },
-                        {"type": "text", "text": prompt}
-                    ]
-                }]
+            response = await self.claude_client.messages.create(
+                **self._room_request(image_base64, width, height, context, media_type)
             )
-            
-            response_text = response.content[0].text.strip()
-            
-            # Clean markdown if present
-            if response_text.startswith("```"):
-                response_text = re.sub(r'^```\w*\n?', '', response_text)
-                response_text = re.sub(r'\n?```$', '', response_text)
-            
-            data = json.loads(response_text)
-            return data.get("rooms", [])
+            return self._parse_rooms(response.content[0].text)
             
         except Exception as e:
             print(f"Claude error: {e}")
             return []
     
+    def _room_request(
+        self,
+        image_base64: str,
+        width: int,
+        height: int,
+        context: Optional[str] = None,
+        media_type: str = "image/png"
+    ) -> Dict:
+        """Build the messages.create parameters for room extraction."""
+        prompt = _room_prompt(width, height, context)
+
+        return {
+            "model": self.model,
+            "max_tokens": 4096,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": media_type,
+                            "data": image_base64
+                        }
+                    },
+                    {"type": "text", "text": prompt}
+                ]
+            }]
+        }
+    
+    def _parse_rooms(self, response_text: str) -> List[Dict]:
+        """Parse the rooms list out of Claude's JSON response."""
+        response_text = response_text.strip()
+        
+        # Clean markdown if present
+        if response_text.startswith("```"):
+            newline = response_text.find("\n")
+            response_text = response_text[newline + 1:] if newline != -1 else response_text[3:]
+            if response_text.endswith("```"):
+                response_text = response_text[:-3]
+        
+        data = orjson.loads(response_text)
+        return data.get("rooms", [])
+    
+    def _parse_regions(
+        self,
+        data: Dict,
+        source_size: Tuple[int, int],
+        target_size: Tuple[int, int]
+    ) -> List[Dict]:
+        """
+        Collect labelled room centroids from a RasterScan payload.
+        
+        Accepts regions under "regions", "rooms" or "labels" that carry a
+        name/label plus either a centroid/center point or a polygon of
+        points. Unlabelled geometry is ignored, since buttons are matched
+        to rooms by name.
+        
+        Returns:
+            List of {"room_name", "x", "y"} scaled to target_size, empty if
+            the payload has no labelled regions
+        """
+        regions = data.get("regions") or data.get("rooms") or data.get("labels")
+        if not isinstance(regions, list):
+            return []
+        
+        scale_x = target_size[0] / source_size[0]
+        scale_y = target_size[1] / source_size[1]
+        
+        centroids = []
+        for region in regions:
+            if not isinstance(region, dict):
+                continue
+            name = region.get("name") or region.get("label") or region.get("room_name")
+            if not isinstance(name, str) or not name:
+                continue
+            
+            try:
+                point = region.get("centroid") or region.get("center")
+                if point is None and region.get("polygon"):
+                    points = np.asarray(
+                        [(p["x"], p["y"]) if isinstance(p, dict) else p[:2] for p in region["polygon"]],
+                        dtype=float
+                    )
+                    point = points.mean(axis=0)
+                if point is None:
+                    continue
+                x, y = (point["x"], point["y"]) if isinstance(point, dict) else point[:2]
+                centroids.append({
+                    "room_name": name,
+                    "x": float(x) * scale_x,
+                    "y": float(y) * scale_y
+                })
+            except (KeyError, TypeError, ValueError):
+                continue
+        
+        if centroids:
+            print(f"RasterScan returned {len(centroids)} labelled room centroids")
+        return centroids
+    
     def _create_annotated_image(
         self, 
         original: Image.Image, 
-        rasterscan_overlay: Optional[Image.Image]
+        rasterscan_overlay: Optional[RasterScanOverlay]
     ) -> Image.Image:
         """Create final image with RasterScan overlay."""
         if rasterscan_overlay:
-            result = Image.alpha_composite(original, rasterscan_overlay)
-        else:
-            result = original.copy()
+            overlay_rgb, room_mask, _ = rasterscan_overlay
+            
+            if original.mode in ('RGB', 'L'):
+                # Every room pixel has the same alpha, so on an opaque image
+                # compositing is one fixed-weight blend applied through the mask
+                base = original.convert('RGB')
+                blended = Image.blend(base, overlay_rgb, self.overlay_alpha / 255)
+                return Image.composite(blended, base, room_mask)
+            
+            # Images with transparency need full alpha compositing
+            overlay = overlay_rgb.convert('RGBA')
+            overlay.putalpha(room_mask.point(lambda v: self.overlay_alpha if v else 0))
+            return Image.alpha_composite(original.convert('RGBA'), overlay).convert('RGB')
         
-        return result.convert('RGB')
+        # convert() already returns a new image, no copy needed
+        return original.convert('RGB')
 
 
 async def analyze_floor_plan(
@@ -357,4 +838,7 @@ async def analyze_floor_plan(
         Analysis result dictionary
     """
     service = FloorPlanAnalyzer()
-    return await service.analyze(image_bytes, context)
+    try:
+        return await service.analyze(image_bytes, context)
+    finally:
+        await service.aclose()
@@ -10,19 +10,32 @@ Output:
   - Genre/style classification
 """
 
-import base64
 import io
-import json
+import hashlib
+import threading
+from functools import lru_cache
 import re
 import os
-from typing import Dict, List, Optional
+from typing import Dict, Optional, Tuple
+import orjson
 from PIL import Image
-import anthropic
+import pybase64
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from .claude_client import get_claude_client
 
 
 load_dotenv()
 
+# Furniture categories kept after analysis; matched as substrings of an
+# object's category or name
+_VALID_CATEGORIES = frozenset({
+    "sofa", "couch", "chair", "armchair", "table", "desk", "bed", 
+    "lamp", "rug", "cabinet", "shelf", "dresser", "nightstand",
+    "bookshelf", "ottoman", "bench", "stool", "wardrobe", "mirror"
+})
+_VALID_CATEGORY_PATTERN = re.compile("|".join(map(re.escape, sorted(_VALID_CATEGORIES))))
+
 
 class FurnitureAnalyzer:
     """
@@ -38,14 +51,25 @@ class FurnitureAnalyzer:
         # - "color_palette": dominant colors in the room
     """
     
+    # Claude downscales anything larger, so bigger uploads only cost bandwidth
+    MAX_INPUT_EDGE = 1568
+    # Uploads under this size are sent as-is when they already fit
+    REENCODE_MIN_BYTES = 512 * 1024
+    JPEG_QUALITY = 85
+    
     def __init__(self, claude_api_key: Optional[str] = None):
         self.claude_api_key = claude_api_key or os.getenv("ANTHROPIC_API_KEY")
         self.model = "claude-sonnet-4-20250514"
         
         if self.claude_api_key:
-            self.claude_client = anthropic.Anthropic(api_key=self.claude_api_key)
+            self.claude_client = get_claude_client(self.claude_api_key)
         else:
             self.claude_client = None
+        
+        # Results by image SHA-256, so /analyze-furniture and /analyze-and-shop
+        # on the same upload share one Claude call
+        self._cache = TTLCache(maxsize=64, ttl=24 * 3600)
+        self._cache_lock = threading.Lock()
     
     def analyze(self, image_bytes: bytes) -> Dict:
         """
@@ -61,6 +85,13 @@ class FurnitureAnalyzer:
                 - overall_style: Room genre/style
                 - color_palette: Dominant colors
         """
+        cache_key = hashlib.sha256(image_bytes).hexdigest()
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+        if cached is not None:
+            print(f"Furniture cache hit: {cache_key[:12]}")
+            return dict(cached)
+        
         try:
             image = Image.open(io.BytesIO(image_bytes))
             width, height = image.size
@@ -71,15 +102,29 @@ class FurnitureAnalyzer:
             if media_type == "image/jpg":
                 media_type = "image/jpeg"
             
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            # Shrink and re-encode large uploads before sending them
+            reencoded = self._reencode(image, len(image_bytes))
+            if reencoded is None:
+                image_base64 = pybase64.b64encode_as_string(image_bytes)
+            else:
+                buffer, (width, height) = reencoded
+                media_type = "image/jpeg"
+                with buffer.getbuffer() as view:
+                    image_base64 = pybase64.b64encode_as_string(view)
             
             analysis = self._analyze_with_claude(image_base64, width, height, media_type)
             
-            return {
+            result = {
                 "status": "success",
                 **analysis
             }
             
+            # A missing style means Claude failed or isn't configured
+            if analysis["overall_style"] is not None:
+                with self._cache_lock:
+                    self._cache[cache_key] = result
+            return dict(result)
+            
         except Exception as e:
             return {
                 "status": "error",
@@ -89,6 +134,51 @@ class FurnitureAnalyzer:
                 "color_palette": []
             }
     
+    def _reencode(self, image: Image.Image, upload_size: int) -> Optional[Tuple[io.BytesIO, Tuple[int, int]]]:
+        """
+        Downscale an upload to MAX_INPUT_EDGE and re-encode it as JPEG.
+        
+        Args:
+            image: Decoded upload
+            upload_size: Size of the upload in bytes
+        
+        Returns:
+            Buffer holding the JPEG and its dimensions, or None when the original
+            upload should be sent unchanged
+        """
+        width, height = image.size
+        scale = self.MAX_INPUT_EDGE / max(width, height)
+        if scale >= 1.0 and upload_size < self.REENCODE_MIN_BYTES:
+            return None
+        
+        image = self._flatten(image)
+        if scale < 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=self.JPEG_QUALITY)
+        
+        # An already well-compressed upload that fits can beat the re-encode
+        if scale >= 1.0 and buffer.tell() >= upload_size:
+            return None
+        return buffer, image.size
+    
+    def _flatten(self, image: Image.Image) -> Image.Image:
+        """Convert to RGB for JPEG, placing transparent images on white."""
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or (
+            image.mode == "P" and "transparency" in image.info
+        )
+        if not has_alpha:
+            return image.convert("RGB")
+        
+        # Transparent pixels usually hold black, which would otherwise
+        # become the background Claude sees
+        image = image.convert("RGBA")
+        canvas = Image.new("RGB", image.size, (255, 255, 255))
+        canvas.paste(image, mask=image.getchannel("A"))
+        return canvas
+    
     def _analyze_with_claude(
         self, 
         image_base64: str, 
@@ -122,7 +212,7 @@ Also provide:
 - overall_style: The overall room style
 - color_palette: Top 3 dominant colors
 
-Return ONLY valid JSON:
+Return ONLY valid JSON, minified on a single line with no markdown fences, in this shape:
 
 {{
   "objects": [
@@ -147,7 +237,7 @@ Only include 5-6 main furniture pieces, not small decor."""
         try:
             response = self.claude_client.messages.create(
                 model=self.model,
-                max_tokens=4096,
+                max_tokens=1024,
                 messages=[{
                     "role": "user",
                     "content": [
@@ -167,26 +257,24 @@ Only include 5-6 main furniture pieces, not small decor."""
             response_text = response.content[0].text.strip()
             
             if response_text.startswith("```"):
-                response_text = re.sub(r'^```\w*\n?', '', response_text)
-                response_text = re.sub(r'\n?```$', '', response_text)
+                newline = response_text.find("\n")
+                response_text = response_text[newline + 1:] if newline != -1 else response_text[3:]
+                if response_text.endswith("```"):
+                    response_text = response_text[:-3]
             
-            data = json.loads(response_text)
+            data = orjson.loads(response_text)
             objects = data.get("objects", [])
             
             # Filter to only keep real furniture items (not abstract or unclear)
-            valid_categories = {
-                "sofa", "couch", "chair", "armchair", "table", "desk", "bed", 
-                "lamp", "rug", "cabinet", "shelf", "dresser", "nightstand",
-                "bookshelf", "ottoman", "bench", "stool", "wardrobe", "mirror"
-            }
-            
             verified_objects = []
             for obj in objects:
                 category = obj.get("category", "").lower()
                 name = obj.get("name", "").lower()
                 
                 # Check if it's a real furniture category
-                is_valid = any(cat in category or cat in name for cat in valid_categories)
+                is_valid = bool(
+                    _VALID_CATEGORY_PATTERN.search(category) or _VALID_CATEGORY_PATTERN.search(name)
+                )
                 
                 if is_valid and obj.get("primary_color"):
                     verified_objects.append(obj)
@@ -216,5 +304,9 @@ def analyze_furniture(image_bytes: bytes) -> Dict:
     Returns:
         Analysis result dictionary
     """
-    analyzer = FurnitureAnalyzer()
-    return analyzer.analyze(image_bytes)
+    return _default_analyzer().analyze(image_bytes)
+
+
+@lru_cache(maxsize=None)
+def _default_analyzer() -> FurnitureAnalyzer:
+    return FurnitureAnalyzer()
@@ -10,28 +10,99 @@ Output:
 """
 
 import os
+import copy
 import json
-import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import base64
+import threading
 import requests
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
+from urllib.parse import quote_plus
+from typing import Dict, List, Optional, Tuple
 import anthropic
+import httpx
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from .claude_client import get_claude_client
 
 
 load_dotenv()
 
+# Fallback connection pools for agents created without a client, one per
+# event loop: pooled connections can't be reused once their loop has closed
+_http_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+_http_clients_lock = threading.Lock()
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Return the async HTTP client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _http_clients_lock:
+        client = _http_clients.get(loop)
+        if client is None or client.is_closed:
+            # Drop clients left behind by loops that have finished
+            for old_loop in [old for old in _http_clients if old.is_closed()]:
+                del _http_clients[old_loop]
+            client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+            _http_clients[loop] = client
+        return client
+
+
+# Keep-alive pool for the synchronous ThorData and imgbb calls
+_requests_session: Optional[requests.Session] = None
+
+
+def _get_requests_session() -> requests.Session:
+    """Return the module-wide requests session, creating it on first use."""
+    global _requests_session
+    if _requests_session is None:
+        # Retry throttling and gateway errors, but not read timeouts, which
+        # would multiply the 30s wait
+        retry = Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False
+        )
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry))
+        _requests_session = session
+    return _requests_session
+
 
 class VisualSearchAgent:
     """
     Uses ThorData ScraperAPI for Google Shopping visual search.
     
     Requires THORDATA_API_KEY in .env file.
+    
+    Args:
+        client: Optional shared async HTTP client. The API passes its
+            app-wide pool; standalone use falls back to a module client.
     """
     
-    def __init__(self):
+    # Image host used to give Google Lens a public URL
+    UPLOAD_URL = "https://api.imgbb.com/1/upload"
+    
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.api_key = os.getenv("THORDATA_API_KEY", "1343027dc933c157df9a487525ab976c")
         self.base_url = "https://scraperapi.thordata.com/request"
+        self.client = client
+        
+        # Many rooms share queries like "modern sofa", so cache results by
+        # query (and Lens results by image URL)
+        self._search_cache = TTLCache(maxsize=4096, ttl=3600)
+        self._cache_lock = threading.Lock()
     
     def search_products(self, query: str) -> Dict:
         """
@@ -43,105 +114,190 @@ class VisualSearchAgent:
         Returns:
             Best matching product with link
         """
+        cache_key = query.lower().strip()
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            # Use regular Google search with "buy" keyword
-            data = {
-                "engine": "google",
-                "q": f"{query} buy",
-                "json": "1"
-            }
-            
-            response = requests.post(self.base_url, headers=headers, data=data, timeout=30)
-            result = response.json()
-            
-            # Check for shopping results first (has prices)
-            shopping = result.get("shopping_results", []) or result.get("popular_products", [])
-            if shopping:
-                best = shopping[0]
-                print(f"Shopping result keys: {list(best.keys())}")
-                print(f"Shopping result sample: {json.dumps(best)[:500]}")
-                
-                # Try multiple link fields
-                link = best.get("link") or best.get("product_link") or best.get("url") or best.get("serpapi_link") or ""
-                
-                # If still no link, construct Google Shopping search URL
-                if not link and best.get("title"):
-                    search_title = best.get("title", "").replace(" ", "+")
-                    link = f"https://www.google.com/search?tbm=shop&q={search_title}"
-                
-                return {
-                    "product": {
-                        "title": best.get("title", ""),
-                        "link": link,
-                        "price": best.get("price", best.get("extracted_price", "Price not available")),
-                        "source": best.get("source", best.get("merchant", "")),
-                        "rating": best.get("rating"),
-                        "thumbnail": best.get("thumbnail", "")
-                    }
-                }
-            
-            # Fallback to organic results
-            organic = result.get("organic", []) or result.get("organic_results", [])
-            if organic:
-                best = organic[0]
-                return {
-                    "product": {
-                        "title": best.get("title", ""),
-                        "link": best.get("link", ""),
-                        "price": "Visit site for price",
-                        "source": best.get("displayed_link", ""),
-                        "snippet": best.get("snippet", "")
-                    }
-                }
-            
-            return {"product": None, "message": "No products found"}
+            response = _get_requests_session().post(
+                self.base_url,
+                headers=self._headers(),
+                data=self._search_data(query),
+                timeout=30
+            )
+            # Error bodies must not be cached as "no products"
+            response.raise_for_status()
+            return self._set_cached(cache_key, self._parse_search_result(response.json()))
             
         except Exception as e:
             print(f"ThorData error: {e}")
             return {"error": str(e), "product": None}
     
-    def search_by_image_url(self, image_url: str) -> Dict:
+    async def search_products_async(self, query: str) -> Dict:
         """
-        Search using Google Lens with image URL.
+        Async version of search_products using the shared connection pool.
+        
+        Args:
+            query: Search query (e.g., "grey fabric sofa buy")
+        
+        Returns:
+            Best matching product with link
         """
+        cache_key = query.lower().strip()
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            data = {
-                "engine": "google_lens",
-                "url": image_url,
-                "json": "1"
-            }
+            client = self.client or _get_http_client()
+            response = await client.post(
+                self.base_url,
+                headers=self._headers(),
+                data=self._search_data(query)
+            )
+            # Error bodies must not be cached as "no products"
+            response.raise_for_status()
+            return self._set_cached(cache_key, self._parse_search_result(response.json()))
             
-            response = requests.post(self.base_url, headers=headers, data=data, timeout=30)
-            result = response.json()
+        except Exception as e:
+            print(f"ThorData error: {e}")
+            return {"error": str(e), "product": None}
+    
+    async def search_products_batch(self, queries: List[str]) -> List[Dict]:
+        """
+        Search for several queries in one call.
+        
+        ThorData has no bulk endpoint, so each distinct query is sent once
+        and all of them run concurrently over the shared connection pool.
+        
+        Args:
+            queries: Search queries, duplicates allowed
+        
+        Returns:
+            One result per query, in the same order as `queries`
+        """
+        unique_queries = list(dict.fromkeys(queries))
+        results = await asyncio.gather(
+            *[self.search_products_async(query) for query in unique_queries],
+            return_exceptions=True
+        )
+        results_by_query = {
+            query: result if isinstance(result, dict) else {"error": str(result), "product": None}
+            for query, result in zip(unique_queries, results)
+        }
+        return [results_by_query[query] for query in queries]
+    
+    def _get_cached(self, key: str) -> Optional[Dict]:
+        """Return a copy of a cached result, so callers can't alter the entry."""
+        with self._cache_lock:
+            cached = self._search_cache.get(key)
+        return copy.deepcopy(cached) if cached is not None else None
+    
+    def _set_cached(self, key: str, result: Dict) -> Dict:
+        with self._cache_lock:
+            self._search_cache[key] = copy.deepcopy(result)
+        return result
+    
+    def _headers(self) -> Dict:
+        return {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+    
+    def _search_data(self, query: str) -> Dict:
+        # Use regular Google search with "buy" keyword
+        return {
+            "engine": "google",
+            "q": f"{query} buy",
+            "json": "1"
+        }
+    
+    def _parse_search_result(self, result: Dict) -> Dict:
+        """Pick the best product from a ThorData Google search response."""
+        # Check for shopping results first (has prices)
+        shopping = result.get("shopping_results", []) or result.get("popular_products", [])
+        if shopping:
+            best = shopping[0]
             
-            print(f"Google Lens response: {json.dumps(result)[:500]}")
+            # Try multiple link fields
+            link = best.get("link") or best.get("product_link") or best.get("url") or best.get("serpapi_link") or ""
             
-            # Get visual matches or products
-            products = result.get("visual_matches", []) or result.get("products", [])
+            # If still no link, construct Google Shopping search URL
+            if not link and best.get("title"):
+                search_title = best.get("title", "").replace(" ", "+")
+                link = f"https://www.google.com/search?tbm=shop&q={search_title}"
             
-            if products:
-                best = products[0]
-                return {
-                    "product": {
-                        "title": best.get("title", ""),
-                        "link": best.get("link", ""),
-                        "source": best.get("source", ""),
-                        "price": best.get("price"),
-                        "thumbnail": best.get("thumbnail", "")
-                    }
+            return {
+                "product": {
+                    "title": best.get("title", ""),
+                    "link": link,
+                    "price": best.get("price", best.get("extracted_price", "Price not available")),
+                    "source": best.get("source", best.get("merchant", "")),
+                    "rating": best.get("rating"),
+                    "thumbnail": best.get("thumbnail", "")
+                }
+            }
+        
+        # Fallback to organic results
+        organic = result.get("organic", []) or result.get("organic_results", [])
+        if organic:
+            best = organic[0]
+            return {
+                "product": {
+                    "title": best.get("title", ""),
+                    "link": best.get("link", ""),
+                    "price": "Visit site for price",
+                    "source": best.get("displayed_link", ""),
+                    "snippet": best.get("snippet", "")
                 }
+            }
+        
+        return {"product": None, "message": "No products found"}
+    
+    def search_by_image_url(self, image_url: str) -> Dict:
+        """
+        Search using Google Lens with image URL.
+        """
+        cache_key = self._lens_cache_key(image_url)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = _get_requests_session().post(
+                self.base_url,
+                headers=self._headers(),
+                data=self._lens_data(image_url),
+                timeout=30
+            )
+            # Error bodies must not be cached as "no products"
+            response.raise_for_status()
+            return self._set_cached(cache_key, self._parse_lens_result(response.json()))
             
-            return {"product": None, "message": "No visual matches found"}
+        except Exception as e:
+            print(f"Google Lens error: {e}")
+            return {"error": str(e), "product": None}
+    
+    async def search_by_image_url_async(self, image_url: str) -> Dict:
+        """
+        Async version of search_by_image_url using the shared connection pool.
+        """
+        cache_key = self._lens_cache_key(image_url)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            client = self.client or _get_http_client()
+            response = await client.post(
+                self.base_url,
+                headers=self._headers(),
+                data=self._lens_data(image_url)
+            )
+            # Error bodies must not be cached as "no products"
+            response.raise_for_status()
+            return self._set_cached(cache_key, self._parse_lens_result(response.json()))
             
         except Exception as e:
             print(f"Google Lens error: {e}")
@@ -151,30 +307,257 @@ class VisualSearchAgent:
         """
         Upload image and search using Google Lens.
         """
+        # imgbb hands out a new URL per upload, so also key on the image itself
+        cache_key = self._lens_cache_key(image_base64)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            # Upload to imgbb
-            upload_url = "https://api.imgbb.com/1/upload"
-            upload_data = {
-                "key": "d36eb6591370ae7f9089d85875571701",  # Free imgbb key
-                "image": image_base64
-            }
-            
-            upload_response = requests.post(upload_url, data=upload_data, timeout=30)
-            upload_result = upload_response.json()
-            
-            print(f"Upload result: {upload_result.get('success')}")
-            
-            if upload_result.get("success") and upload_result.get("data", {}).get("url"):
-                image_url = upload_result["data"]["url"]
-                print(f"Image uploaded: {image_url}")
-                return self.search_by_image_url(image_url)
-            else:
-                print(f"Upload failed: {upload_result}")
+            upload_response = _get_requests_session().post(
+                self.UPLOAD_URL,
+                data=self._upload_data(image_base64),
+                timeout=30
+            )
+            image_url = self._uploaded_image_url(upload_response.json())
+            if image_url is None:
                 return {"error": "Failed to upload image", "product": None}
+            result = self.search_by_image_url(image_url)
+            return self._set_cached(cache_key, result) if "error" not in result else result
                 
         except Exception as e:
             print(f"Upload error: {e}")
             return {"error": str(e), "product": None}
+    
+    async def search_by_image_base64_async(self, image_base64: str) -> Dict:
+        """
+        Async version of search_by_image_base64; the upload and the Lens
+        search run back to back in one coroutine, so several images can be
+        searched concurrently with asyncio.gather.
+        """
+        # imgbb hands out a new URL per upload, so also key on the image itself
+        cache_key = self._lens_cache_key(image_base64)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            client = self.client or _get_http_client()
+            upload_response = await client.post(
+                self.UPLOAD_URL,
+                data=self._upload_data(image_base64)
+            )
+            image_url = self._uploaded_image_url(upload_response.json())
+            if image_url is None:
+                return {"error": "Failed to upload image", "product": None}
+            result = await self.search_by_image_url_async(image_url)
+            return self._set_cached(cache_key, result) if "error" not in result else result
+                
+        except Exception as e:
+            print(f"Upload error: {e}")
+            return {"error": str(e), "product": None}
+    
+    async def search_by_image_base64_batch(self, images_base64: List[str]) -> List[Dict]:
+        """
+        Run visual searches for several images at once.
+        
+        Each distinct image gets its own upload-then-Lens coroutine, so a
+        Lens lookup starts as soon as its own upload finishes rather than
+        waiting for the slowest upload.
+        
+        Args:
+            images_base64: Base64-encoded images, duplicates allowed
+        
+        Returns:
+            One result per image, in the same order as `images_base64`
+        """
+        unique_images = list(dict.fromkeys(images_base64))
+        results = await asyncio.gather(
+            *[self.search_by_image_base64_async(image) for image in unique_images],
+            return_exceptions=True
+        )
+        results_by_image = {
+            image: result if isinstance(result, dict) else {"error": str(result), "product": None}
+            for image, result in zip(unique_images, results)
+        }
+        return [results_by_image[image] for image in images_base64]
+    
+    def _lens_cache_key(self, image: str) -> str:
+        # Prefixed so image URLs and data can't collide with text queries in the shared cache
+        return "lens:" + hashlib.blake2b(image.encode()).hexdigest()
+    
+    def _lens_data(self, image_url: str) -> Dict:
+        return {
+            "engine": "google_lens",
+            "url": image_url,
+            "json": "1"
+        }
+    
+    def _parse_lens_result(self, result: Dict) -> Dict:
+        """Pick the best visual match from a Google Lens response."""
+        # Get visual matches or products
+        products = result.get("visual_matches", []) or result.get("products", [])
+        
+        if products:
+            best = products[0]
+            return {
+                "product": {
+                    "title": best.get("title", ""),
+                    "link": best.get("link", ""),
+                    "source": best.get("source", ""),
+                    "price": best.get("price"),
+                    "thumbnail": best.get("thumbnail", "")
+                }
+            }
+        
+        return {"product": None, "message": "No visual matches found"}
+    
+    def _upload_data(self, image_base64: str) -> Dict:
+        return {
+            "key": "d36eb6591370ae7f9089d85875571701",  # Free imgbb key
+            "image": image_base64
+        }
+    
+    def _uploaded_image_url(self, upload_result: Dict) -> Optional[str]:
+        """Return the hosted image URL from an imgbb upload response, or None."""
+        print(f"Upload result: {upload_result.get('success')}")
+        
+        if upload_result.get("success") and upload_result.get("data", {}).get("url"):
+            image_url = upload_result["data"]["url"]
+            print(f"Image uploaded: {image_url}")
+            return image_url
+        
+        print(f"Upload failed: {upload_result}")
+        return None
+
+
+# Basic color mapping for _hex_to_color_name
+_COLOR_NAMES = {
+    "#FFFFFF": "white",
+    "#000000": "black",
+    "#808080": "grey",
+    "#C0C0C0": "silver",
+    "#FF0000": "red",
+    "#00FF00": "green",
+    "#0000FF": "blue",
+    "#FFFF00": "yellow",
+    "#FFA500": "orange",
+    "#800080": "purple",
+    "#FFC0CB": "pink",
+    "#A52A2A": "brown",
+    "#8B4513": "brown",
+    "#D2691E": "brown",
+    "#F5DEB3": "beige",
+    "#DEB887": "tan",
+    "#2C3E50": "navy",
+    "#1ABC9C": "teal",
+    "#E74C3C": "red",
+    "#3498DB": "blue",
+    "#2ECC71": "green",
+    "#F39C12": "gold",
+    "#9B59B6": "purple",
+    "#34495E": "charcoal",
+    "#ECF0F1": "off-white",
+    "#95A5A6": "grey",
+}
+
+# Search URL prefixes for stores Claude recommends
+_STORE_SEARCH_URLS = {
+    "IKEA": "https://www.ikea.com/us/en/search/?q=",
+    "Wayfair": "https://www.wayfair.com/keyword.html?keyword=",
+    "Amazon": "https://www.amazon.com/s?k=",
+    "Target": "https://www.target.com/s?searchTerm=",
+    "West Elm": "https://www.westelm.com/search/?q=",
+    "Walmart": "https://www.walmart.com/search?q=",
+    "Google Shopping": "https://www.google.com/search?tbm=shop&q=",
+}
+
+
+@lru_cache(maxsize=1024)
+def _hex_to_color_name(hex_color: str) -> str:
+    """Convert hex color to approximate color name."""
+    if not hex_color or not hex_color.startswith("#"):
+        return ""
+    
+    hex_upper = hex_color.upper()
+    if hex_upper in _COLOR_NAMES:
+        return _COLOR_NAMES[hex_upper]
+    
+    # Parse RGB and determine closest basic color
+    try:
+        hex_clean = hex_color.lstrip('#')
+        r = int(hex_clean[0:2], 16)
+        g = int(hex_clean[2:4], 16)
+        b = int(hex_clean[4:6], 16)
+        
+        # Simple color classification
+        if r > 200 and g > 200 and b > 200:
+            return "white"
+        elif r < 50 and g < 50 and b < 50:
+            return "black"
+        elif r > 150 and g < 100 and b < 100:
+            return "red"
+        elif r < 100 and g > 150 and b < 100:
+            return "green"
+        elif r < 100 and g < 100 and b > 150:
+            return "blue"
+        elif r > 150 and g > 150 and b < 100:
+            return "yellow"
+        elif r > 150 and g > 100 and b < 100:
+            return "orange"
+        elif r > 100 and g < 100 and b > 100:
+            return "purple"
+        elif r > 100 and g > 80 and b < 80:
+            return "brown"
+        elif abs(r - g) < 30 and abs(g - b) < 30:
+            return "grey"
+        else:
+            return "neutral"
+    except:
+        return ""
+
+
+@lru_cache(maxsize=1024)
+def _search_queries(
+    name: str,
+    category: str,
+    style: Optional[str],
+    material: Optional[str],
+    primary_color: str
+) -> Tuple[str, ...]:
+    """Generate search queries from an object's first style and material tags."""
+    # Convert hex to color name
+    color_name = _hex_to_color_name(primary_color)
+    
+    queries = []
+    
+    # Basic query
+    queries.append(f"{name} {category}")
+    
+    # Style-based query
+    if style is not None:
+        queries.append(f"{style} {category}")
+    
+    # Color + style query
+    if color_name and style is not None:
+        queries.append(f"{color_name} {style} {category}")
+    
+    # Material-based query
+    if material is not None:
+        queries.append(f"{material} {category}")
+    
+    # Full descriptive query
+    full_query_parts = []
+    if color_name:
+        full_query_parts.append(color_name)
+    if style is not None:
+        full_query_parts.append(style)
+    if material is not None:
+        full_query_parts.append(material)
+    full_query_parts.append(category)
+    queries.append(" ".join(full_query_parts))
+    
+    return tuple(dict.fromkeys(queries))  # Remove duplicates, keeping order
 
 
 class ProductSearchAgent:
@@ -188,14 +571,26 @@ class ProductSearchAgent:
         results = agent.search(furniture_object)
     """
     
+    # Claude calls in flight at once during search_all
+    MAX_CONCURRENT_SEARCHES = 8
+    
     def __init__(self, claude_api_key: Optional[str] = None):
         self.claude_api_key = claude_api_key or os.getenv("ANTHROPIC_API_KEY")
         self.model = "claude-sonnet-4-20250514"
         
         if self.claude_api_key:
-            self.claude_client = anthropic.Anthropic(api_key=self.claude_api_key)
+            self.claude_client = get_claude_client(self.claude_api_key)
+            self.async_claude_client = anthropic.AsyncAnthropic(api_key=self.claude_api_key)
         else:
             self.claude_client = None
+            self.async_claude_client = None
+        
+        # Recommendations cached by the canonical JSON of the furniture object
+        self._search_cache = TTLCache(maxsize=4096, ttl=3600)
+        # Claude's answers cached by prompt, which only uses a few fields, so
+        # objects differing in e.g. description share one call
+        self._recommendation_cache = TTLCache(maxsize=4096, ttl=3600)
+        self._cache_lock = threading.Lock()
         
         # Popular furniture retailers
         self.retailers = [
@@ -221,6 +616,11 @@ class ProductSearchAgent:
         Returns:
             Dict with search results and product recommendations
         """
+        cache_key = json.dumps(furniture_object, sort_keys=True)
+        cached = self._cached_search(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             # Generate search queries
             search_queries = self._generate_search_queries(furniture_object)
@@ -228,150 +628,245 @@ class ProductSearchAgent:
             # Get product recommendations from Claude
             recommendations = self._get_recommendations(furniture_object, search_queries)
             
-            return {
-                "status": "success",
-                "object": furniture_object.get("name", "Unknown"),
-                "search_queries": search_queries,
-                "recommendations": recommendations
-            }
+            return self._search_result(cache_key, furniture_object, search_queries, recommendations)
             
         except Exception as e:
-            return {
-                "status": "error",
-                "error": str(e),
-                "object": furniture_object.get("name", "Unknown"),
-                "search_queries": [],
-                "recommendations": []
-            }
+            return self._search_error(furniture_object, e)
+    
+    async def search_async(self, furniture_object: Dict) -> Dict:
+        """
+        Async version of search using the async Claude client.
+        
+        Args:
+            furniture_object: Dict with name, category, colors, style_tags, etc.
+        
+        Returns:
+            Dict with search results and product recommendations
+        """
+        cache_key = json.dumps(furniture_object, sort_keys=True)
+        cached = self._cached_search(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            search_queries = self._generate_search_queries(furniture_object)
+            recommendations = await self._get_recommendations_async(furniture_object, search_queries)
+            return self._search_result(cache_key, furniture_object, search_queries, recommendations)
+            
+        except Exception as e:
+            return self._search_error(furniture_object, e)
+    
+    def _search_result(
+        self,
+        cache_key: str,
+        furniture_object: Dict,
+        search_queries: List[str],
+        recommendations: List[Dict]
+    ) -> Dict:
+        result = {
+            "status": "success",
+            "object": furniture_object.get("name", "Unknown"),
+            "search_queries": search_queries,
+            "recommendations": recommendations
+        }
+        
+        # Empty recommendations mean Claude failed or isn't configured
+        if recommendations:
+            with self._cache_lock:
+                self._search_cache[cache_key] = copy.deepcopy(result)
+        
+        return result
+    
+    def _cached_search(self, cache_key: str) -> Optional[Dict]:
+        """Return a copy of the cached search result for an object, if any."""
+        with self._cache_lock:
+            cached = self._search_cache.get(cache_key)
+        return copy.deepcopy(cached) if cached is not None else None
+    
+    def _search_error(self, furniture_object: Dict, error: Exception) -> Dict:
+        return {
+            "status": "error",
+            "error": str(error),
+            "object": furniture_object.get("name", "Unknown"),
+            "search_queries": [],
+            "recommendations": []
+        }
     
     def search_all(self, furniture_objects: List[Dict]) -> List[Dict]:
         """
         Search for products for multiple furniture objects.
         
+        Runs the searches on worker threads with the shared sync client, so
+        it works from any thread, including under a running event loop.
+        Async callers should await search_all_async instead.
+        
         Args:
             furniture_objects: List of furniture object dicts
         
         Returns:
             List of search results for each object
         """
-        results = []
-        for obj in furniture_objects:
-            result = self.search(obj)
-            results.append(result)
+        if len(furniture_objects) < 2:
+            return [self.search(obj) for obj in furniture_objects]
+        
+        results: List[Optional[Dict]] = [None] * len(furniture_objects)
+        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_SEARCHES) as executor:
+            # Duplicates go second so they reuse the first copy's recommendations
+            for indices in self._split_duplicates(furniture_objects):
+                objects = [furniture_objects[i] for i in indices]
+                for i, result in zip(indices, executor.map(self.search, objects)):
+                    results[i] = result
         return results
     
-    def _generate_search_queries(self, furniture_object: Dict) -> List[str]:
-        """Generate search queries based on furniture details."""
-        name = furniture_object.get("name", "")
-        category = furniture_object.get("category", "")
-        style_tags = furniture_object.get("style_tags", [])
-        material_tags = furniture_object.get("material_tags", [])
-        primary_color = furniture_object.get("primary_color", "")
+    async def search_all_async(self, furniture_objects: List[Dict]) -> List[Dict]:
+        """
+        Search for products for multiple furniture objects concurrently.
         
-        # Convert hex to color name
-        color_name = self._hex_to_color_name(primary_color)
+        Each object needs its own Claude round trip, so the calls run
+        together, at most MAX_CONCURRENT_SEARCHES at a time.
         
-        queries = []
+        Args:
+            furniture_objects: List of furniture object dicts
         
-        # Basic query
-        queries.append(f"{name} {category}")
+        Returns:
+            List of search results, in the same order as `furniture_objects`
+        """
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_SEARCHES)
         
-        # Style-based query
-        if style_tags:
-            queries.append(f"{style_tags[0]} {category}")
+        async def search_one(obj: Dict) -> Dict:
+            async with semaphore:
+                return await self.search_async(obj)
         
-        # Color + style query
-        if color_name and style_tags:
-            queries.append(f"{color_name} {style_tags[0]} {category}")
+        results: List[Optional[Dict]] = [None] * len(furniture_objects)
+        # Duplicates go second so they reuse the first copy's recommendations
+        for indices in self._split_duplicates(furniture_objects):
+            found = await asyncio.gather(*[search_one(furniture_objects[i]) for i in indices])
+            for i, result in zip(indices, found):
+                results[i] = result
+        return results
+    
+    def _split_duplicates(self, furniture_objects: List[Dict]) -> Tuple[List[int], List[int]]:
+        """
+        Split object indices by recommendation prompt.
         
-        # Material-based query
-        if material_tags:
-            queries.append(f"{material_tags[0]} {category}")
+        Returns:
+            Indices of the first object for each distinct prompt, and
+            indices of the rest
+        """
+        first, rest = [], []
+        seen = set()
+        for i, obj in enumerate(furniture_objects):
+            try:
+                prompt = self._recommendation_prompt(obj)
+            except Exception:
+                first.append(i)  # Let search() report the bad object
+                continue
+            if prompt in seen:
+                rest.append(i)
+            else:
+                seen.add(prompt)
+                first.append(i)
+        return first, rest
+    
+    async def search_all_batched(
+        self,
+        furniture_objects: List[Dict],
+        poll_interval: float = 30.0
+    ) -> List[Dict]:
+        """
+        Search for products for many furniture objects through the Message Batches API.
         
-        # Full descriptive query
-        full_query_parts = []
-        if color_name:
-            full_query_parts.append(color_name)
-        if style_tags:
-            full_query_parts.append(style_tags[0])
-        if material_tags:
-            full_query_parts.append(material_tags[0])
-        full_query_parts.append(category)
-        queries.append(" ".join(full_query_parts))
-        
-        return list(set(queries))  # Remove duplicates
-    
-    def _hex_to_color_name(self, hex_color: str) -> str:
-        """Convert hex color to approximate color name."""
-        if not hex_color or not hex_color.startswith("#"):
-            return ""
-        
-        # Basic color mapping
-        color_map = {
-            "#FFFFFF": "white",
-            "#000000": "black",
-            "#808080": "grey",
-            "#C0C0C0": "silver",
-            "#FF0000": "red",
-            "#00FF00": "green",
-            "#0000FF": "blue",
-            "#FFFF00": "yellow",
-            "#FFA500": "orange",
-            "#800080": "purple",
-            "#FFC0CB": "pink",
-            "#A52A2A": "brown",
-            "#8B4513": "brown",
-            "#D2691E": "brown",
-            "#F5DEB3": "beige",
-            "#DEB887": "tan",
-            "#2C3E50": "navy",
-            "#1ABC9C": "teal",
-            "#E74C3C": "red",
-            "#3498DB": "blue",
-            "#2ECC71": "green",
-            "#F39C12": "gold",
-            "#9B59B6": "purple",
-            "#34495E": "charcoal",
-            "#ECF0F1": "off-white",
-            "#95A5A6": "grey",
-        }
+        Meant for bulk jobs rather than interactive requests: batched Claude
+        calls cost half as much but can take minutes to complete. Cached and
+        duplicate objects are not resubmitted.
         
-        hex_upper = hex_color.upper()
-        if hex_upper in color_map:
-            return color_map[hex_upper]
+        Args:
+            furniture_objects: List of furniture object dicts
+            poll_interval: Seconds between batch status checks
         
-        # Parse RGB and determine closest basic color
-        try:
-            hex_clean = hex_color.lstrip('#')
-            r = int(hex_clean[0:2], 16)
-            g = int(hex_clean[2:4], 16)
-            b = int(hex_clean[4:6], 16)
+        Returns:
+            List of search results, in the same order as `furniture_objects`
+        """
+        if not self.async_claude_client:
+            return await self.search_all_async(furniture_objects)
+        
+        cache_keys = [json.dumps(obj, sort_keys=True) for obj in furniture_objects]
+        results: Dict[str, Dict] = {}
+        pending: Dict[str, Dict] = {}  # cache key -> object
+        prompts: Dict[str, str] = {}  # batch custom_id -> prompt
+        
+        for cache_key, obj in zip(cache_keys, furniture_objects):
+            cached = self._cached_search(cache_key)
+            if cached is not None:
+                results[cache_key] = cached
+            elif cache_key not in pending:
+                pending[cache_key] = obj
+                try:
+                    prompt = self._recommendation_prompt(obj)
+                except Exception:
+                    continue  # Reported as an error below
+                with self._cache_lock:
+                    known = prompt in self._recommendation_cache
+                if not known:
+                    prompts[hashlib.sha256(prompt.encode()).hexdigest()] = prompt
+        
+        if prompts:
+            try:
+                texts = await self._run_batch([
+                    {"custom_id": custom_id, "params": self._recommendation_params(prompt)}
+                    for custom_id, prompt in prompts.items()
+                ], poll_interval)
+            except Exception as e:
+                print(f"Batch search error: {e}")
+                texts = {}
             
-            # Simple color classification
-            if r > 200 and g > 200 and b > 200:
-                return "white"
-            elif r < 50 and g < 50 and b < 50:
-                return "black"
-            elif r > 150 and g < 100 and b < 100:
-                return "red"
-            elif r < 100 and g > 150 and b < 100:
-                return "green"
-            elif r < 100 and g < 100 and b > 150:
-                return "blue"
-            elif r > 150 and g > 150 and b < 100:
-                return "yellow"
-            elif r > 150 and g > 100 and b < 100:
-                return "orange"
-            elif r > 100 and g < 100 and b > 100:
-                return "purple"
-            elif r > 100 and g > 80 and b < 80:
-                return "brown"
-            elif abs(r - g) < 30 and abs(g - b) < 30:
-                return "grey"
+            for custom_id, text in texts.items():
+                try:
+                    self._store_recommendations(prompts[custom_id], self._parse_recommendations(text))
+                except Exception as e:
+                    print(f"Claude error in product search: {e}")
+        
+        for cache_key, obj in pending.items():
+            try:
+                search_queries = self._generate_search_queries(obj)
+                recommendations = self._cached_recommendations(self._recommendation_prompt(obj)) or []
+                results[cache_key] = self._search_result(cache_key, obj, search_queries, recommendations)
+                
+            except Exception as e:
+                results[cache_key] = self._search_error(obj, e)
+        
+        return [results[cache_key] for cache_key in cache_keys]
+    
+    async def _run_batch(self, requests: List[Dict], poll_interval: float) -> Dict[str, str]:
+        """Submit one message batch, poll until it ends, and collect response text."""
+        batches = self.async_claude_client.messages.batches
+        batch = await batches.create(requests=requests)
+        print(f"Submitted message batch {batch.id} with {len(requests)} requests")
+        
+        while batch.processing_status != "ended":
+            await asyncio.sleep(poll_interval)
+            batch = await batches.retrieve(batch.id)
+        
+        texts = {}
+        async for entry in await batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                texts[entry.custom_id] = entry.result.message.content[0].text
             else:
-                return "neutral"
-        except:
-            return ""
+                print(f"Batch request {entry.custom_id[:12]} {entry.result.type}")
+        return texts
+    
+    def _generate_search_queries(self, furniture_object: Dict) -> List[str]:
+        """Generate search queries based on furniture details."""
+        style_tags = furniture_object.get("style_tags", [])
+        material_tags = furniture_object.get("material_tags", [])
+        
+        return list(_search_queries(
+            furniture_object.get("name", ""),
+            furniture_object.get("category", ""),
+            style_tags[0] if style_tags else None,
+            material_tags[0] if material_tags else None,
+            furniture_object.get("primary_color", "")
+        ))
     
     def _get_recommendations(
         self, 
@@ -382,6 +877,56 @@ class ProductSearchAgent:
         if not self.claude_client:
             return []
         
+        try:
+            prompt = self._recommendation_prompt(furniture_object)
+            cached = self._cached_recommendations(prompt)
+            if cached is not None:
+                return cached
+            
+            response = self.claude_client.messages.create(**self._recommendation_params(prompt))
+            return self._store_recommendations(prompt, self._parse_recommendations(response.content[0].text))
+            
+        except Exception as e:
+            print(f"Claude error in product search: {e}")
+            return []
+    
+    async def _get_recommendations_async(
+        self,
+        furniture_object: Dict,
+        search_queries: List[str]
+    ) -> List[Dict]:
+        """Async version of _get_recommendations."""
+        if not self.async_claude_client:
+            return []
+        
+        try:
+            prompt = self._recommendation_prompt(furniture_object)
+            cached = self._cached_recommendations(prompt)
+            if cached is not None:
+                return cached
+            
+            response = await self.async_claude_client.messages.create(**self._recommendation_params(prompt))
+            return self._store_recommendations(prompt, self._parse_recommendations(response.content[0].text))
+            
+        except Exception as e:
+            print(f"Claude error in product search: {e}")
+            return []
+    
+    def _cached_recommendations(self, prompt: str) -> Optional[List[Dict]]:
+        """Return a copy of the cached recommendations for a prompt, if any."""
+        with self._cache_lock:
+            cached = self._recommendation_cache.get(prompt)
+        return [dict(rec) for rec in cached] if cached is not None else None
+    
+    def _store_recommendations(self, prompt: str, recommendations: List[Dict]) -> List[Dict]:
+        # Empty lists mean Claude failed, so they aren't cached
+        if recommendations:
+            with self._cache_lock:
+                self._recommendation_cache[prompt] = [dict(rec) for rec in recommendations]
+        return recommendations
+    
+    def _recommendation_prompt(self, furniture_object: Dict) -> str:
+        """Build the Claude recommendation prompt for one object."""
         name = furniture_object.get("name", "Unknown")
         category = furniture_object.get("category", "furniture")
         description = furniture_object.get("description", "")
@@ -390,7 +935,7 @@ class ProductSearchAgent:
         primary_color = furniture_object.get("primary_color", "")
         
         # Build search query from furniture details
-        color_name = self._hex_to_color_name(primary_color)
+        color_name = _hex_to_color_name(primary_color)
         
         search_terms = []
         if color_name:
@@ -415,7 +960,7 @@ For each, provide:
 2. store: Retailer (IKEA, Wayfair, Amazon, Target)
 3. price_range: Price estimate
 
-Return ONLY valid JSON:
+Return ONLY valid JSON, minified on a single line with no markdown fences, in this shape:
 
 {{
   "recommendations": [
@@ -426,53 +971,46 @@ Return ONLY valid JSON:
 }}
 
 IMPORTANT: Keep search queries SHORT (2-4 words). No long phrases."""
-
-        try:
-            response = self.claude_client.messages.create(
-                model=self.model,
-                max_tokens=2048,
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
-            )
-            
-            response_text = response.content[0].text.strip()
-            
-            if response_text.startswith("```"):
-                response_text = re.sub(r'^```\w*\n?', '', response_text)
-                response_text = re.sub(r'\n?```$', '', response_text)
-            
-            data = json.loads(response_text)
-            recommendations = data.get("recommendations", [])
-            
-            # Generate real search URLs for each recommendation
-            store_urls = {
-                "IKEA": "https://www.ikea.com/us/en/search/?q=",
-                "Wayfair": "https://www.wayfair.com/keyword.html?keyword=",
-                "Amazon": "https://www.amazon.com/s?k=",
-                "Target": "https://www.target.com/s?searchTerm=",
-                "West Elm": "https://www.westelm.com/search/?q=",
-                "Walmart": "https://www.walmart.com/search?q=",
-                "Google Shopping": "https://www.google.com/search?tbm=shop&q=",
-            }
-            
-            for rec in recommendations:
-                query = rec.get("search_query", "")
-                store = rec.get("store", "Google Shopping")
-                
-                # URL encode the query
-                encoded_query = query.replace(" ", "+")
-                
-                # Get the store's search URL
-                base_url = store_urls.get(store, store_urls["Google Shopping"])
-                rec["url"] = f"{base_url}{encoded_query}"
+        
+        return prompt
+    
+    def _recommendation_params(self, prompt: str) -> Dict:
+        """Build the Claude messages.create parameters for a recommendation prompt."""
+        return {
+            "model": self.model,
+            "max_tokens": 512,
+            "messages": [{
+                "role": "user",
+                "content": prompt
+            }]
+        }
+    
+    def _parse_recommendations(self, response_text: str) -> List[Dict]:
+        """Parse Claude's recommendations and attach store search URLs."""
+        response_text = response_text.strip()
+        
+        if response_text.startswith("```"):
+            newline = response_text.find("\n")
+            response_text = response_text[newline + 1:] if newline != -1 else response_text[3:]
+            if response_text.endswith("```"):
+                response_text = response_text[:-3]
+        
+        data = orjson.loads(response_text)
+        recommendations = data.get("recommendations", [])
+        
+        # Generate real search URLs for each recommendation
+        for rec in recommendations:
+            query = rec.get("search_query", "")
+            store = rec.get("store", "Google Shopping")
             
-            return recommendations
+            # URL encode the query
+            encoded_query = quote_plus(query)
             
-        except Exception as e:
-            print(f"Claude error in product search: {e}")
-            return []
+            # Get the store's search URL
+            base_url = _STORE_SEARCH_URLS.get(store, _STORE_SEARCH_URLS["Google Shopping"])
+            rec["url"] = f"{base_url}{encoded_query}"
+        
+        return recommendations
 
 
 def search_products(furniture_object: Dict) -> Dict:
@@ -485,8 +1023,7 @@ def search_products(furniture_object: Dict) -> Dict:
     Returns:
         Search results dictionary
     """
-    agent = ProductSearchAgent()
-    return agent.search(furniture_object)
+    return _default_agent().search(furniture_object)
 
 
 def search_all_products(furniture_objects: List[Dict]) -> List[Dict]:
@@ -499,5 +1036,9 @@ def search_all_products(furniture_objects: List[Dict]) -> List[Dict]:
     Returns:
         List of search results
     """
-    agent = ProductSearchAgent()
-    return agent.search_all(furniture_objects)
+    return _default_agent().search_all(furniture_objects)
+
+
+@lru_cache(maxsize=None)
+def _default_agent() -> ProductSearchAgent:
+    return ProductSearchAgent()
@@ -1,12 +1,24 @@
 """Test floor plan analyzer with button positioning."""
 
+import hashlib
+import sys
 import requests
-import json
+import orjson
 from pathlib import Path
 
 API_URL = "http://127.0.0.1:8000"
+
+# Reuse one keep-alive connection for every request to the API
+SESSION = requests.Session()
+
 OUTPUT_DIR = Path("d:/Flux-hack/LLM/test_output")
 
+# With --cached, successful responses are saved by endpoint and image
+# SHA-256 and reused on later --cached runs; without it the live server
+# is always called
+USE_CACHE = "--cached" in sys.argv
+CACHE_DIR = OUTPUT_DIR / "cache"
+
 # Use the blueprint image
 TEST_IMAGE = "d:/Flux-hack/LLM/test_llms_input/outputBrint.png"
 
@@ -14,19 +26,34 @@ print("Testing Floor Plan Analyzer with Button Positioning...")
 print(f"Image: {TEST_IMAGE}")
 print()
 
+# Open the keep-alive connection with a cheap request before the upload
+try:
+    SESSION.get(f"{API_URL}/health", timeout=60)
+except requests.RequestException:
+    pass
+
 # Test the /analyze endpoint
-with open(TEST_IMAGE, "rb") as f:
-    response = requests.post(
+image_bytes = Path(TEST_IMAGE).read_bytes()
+cache_path = CACHE_DIR / f"analyze_{hashlib.sha256(image_bytes).hexdigest()}.json"
+if USE_CACHE and cache_path.exists():
+    print(f"Using cached response: {cache_path.name}")
+    status_code, content = 200, cache_path.read_bytes()
+else:
+    response = SESSION.post(
         f"{API_URL}/analyze",
-        files={"image": f}
+        files={"image": (Path(TEST_IMAGE).name, image_bytes)}
     )
+    status_code, content = response.status_code, response.content
+    # Error results also come back as 200, so check the status field
+    if USE_CACHE and status_code == 200 and orjson.loads(content).get("status") == "success":
+        CACHE_DIR.mkdir(exist_ok=True)
+        cache_path.write_bytes(content)
 
-print(f"Status: {response.status_code}")
-result = response.json()
+print(f"Status: {status_code}")
+result = orjson.loads(content)
 
 # Save result
-with open(OUTPUT_DIR / "floor_plan_with_buttons.json", "w") as f:
-    json.dump(result, f, indent=2)
+(OUTPUT_DIR / "floor_plan_with_buttons.json").write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
 
 if result.get("status") == "success":
     print(f"\n✓ Analysis successful!")
@@ -38,24 +65,36 @@ if result.get("status") == "success":
     print("ROOM BUTTONS FOR FRONTEND")
     print("="*60)
     
+    # Build each listing first and write it out in one go
+    lines = []
     room_buttons = result.get("room_buttons", [])
     for btn in room_buttons:
         room_data = btn.get("room_data", {})
-        print(f"\n📍 Button: {room_data.get('name', 'Unknown')}")
-        print(f"   Position: ({btn.get('x_percent')}%, {btn.get('y_percent')}%)")
-        print(f"   Type: {room_data.get('type')}")
-        print(f"   Area: {room_data.get('area_sqft')} sq ft")
+        lines.append(
+            f"\n📍 Button: {room_data.get('name', 'Unknown')}\n"
+            f"   Position: ({btn.get('x_percent')}%, {btn.get('y_percent')}%)\n"
+            f"   Type: {room_data.get('type')}\n"
+            f"   Area: {room_data.get('area_sqft')} sq ft"
+        )
+    if lines:
+        print("\n".join(lines))
     
     print("\n" + "="*60)
     print("ROOMS DATA")
     print("="*60)
     
+    lines = []
     for room in result.get("rooms", []):
-        print(f"\n🏠 {room.get('name')} ({room.get('type')})")
-        print(f"   Area: {room.get('area_sqft')} sq ft")
         dims = room.get('dimensions', {})
-        print(f"   Dimensions: {dims.get('length')} x {dims.get('width')}")
-        print(f"   Fixtures: {', '.join(room.get('fixtures', []))}")
+        fixtures = ", ".join(room.get("fixtures", []))
+        lines.append(
+            f"\n🏠 {room.get('name')} ({room.get('type')})\n"
+            f"   Area: {room.get('area_sqft')} sq ft\n"
+            f"   Dimensions: {dims.get('length')} x {dims.get('width')}\n"
+            f"   Fixtures: {fixtures}"
+        )
+    if lines:
+        print("\n".join(lines))
     
     # Check if annotated image was saved
     if result.get("annotated_image_base64"):